@@ -0,0 +1,161 @@
+# Times every pipeline stage on synthetic data and saves the results as JSON.
+#
+#   python -m benchmarks.bench --sites 10,100,1000,10000,50000
+#   python -m benchmarks.bench --label after --compare benchmarks/results/before.json
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from fuel_targets import (future_projection, generate_sales, month_targets, parse_upload,
+                          scenario_sweep, site_projections, site_report, target_sheet, top_months,
+                          trailing_sales)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+MONTH, YEAR = "Dec", 2025
+BASE_YEARS = [2021, 2022, 2024]
+OPTIMISTIC, CONSERVATIVE = 5.0, 10.0
+# 5 x 10 x 10 scenario grid
+SWEEP_BASE_YEARS = [[2021, 2022, 2024], [2022, 2024], [2023, 2024], [2024], [2021, 2022, 2023, 2024]]
+SWEEP_PERCENTS = np.arange(0, 25, 2.5)
+
+
+def measure(fn, repeat):
+    # Best wall time over `repeat` runs, then one traced run for peak memory
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def stages(df, report_sites):
+    csv_bytes = df.to_csv(index=False).encode()
+    buffer = BytesIO()
+    df.to_parquet(buffer, index=False)
+    parquet_bytes = buffer.getvalue()
+
+    store = parse_upload(parquet_bytes, "parquet")
+    sites = store.sites
+    results_df, _ = month_targets(store, sites, MONTH, BASE_YEARS, OPTIMISTIC, CONSERVATIVE)
+    trend_df = trailing_sales(store, sites, MONTH, YEAR)
+    sample = sites[:report_sites]
+
+    def projections():
+        future_projection(results_df, trend_df, MONTH, YEAR, OPTIMISTIC, CONSERVATIVE)
+        site_projections(store, sites, MONTH, YEAR, BASE_YEARS, OPTIMISTIC, CONSERVATIVE)
+
+    def reports():
+        for site in sample:
+            site_report(store, results_df, site, MONTH, YEAR, BASE_YEARS)
+
+    n_rows, n_sites = len(df), len(sites)
+    return [
+        ("ingest_csv", lambda: parse_upload(csv_bytes, "csv"), n_rows, "rows"),
+        ("ingest_parquet", lambda: parse_upload(parquet_bytes, "parquet"), n_rows, "rows"),
+        ("targets_per_site", lambda: month_targets(store, sites, MONTH, BASE_YEARS, OPTIMISTIC,
+                                                   CONSERVATIVE), n_sites, "sites"),
+        ("targets_combined", lambda: month_targets(store, sites, MONTH, BASE_YEARS, OPTIMISTIC,
+                                                   CONSERVATIVE, "Combined"), n_sites, "sites"),
+        ("target_sheet", lambda: target_sheet(store, BASE_YEARS, OPTIMISTIC, CONSERVATIVE),
+         n_sites, "sites"),
+        ("scenario_sweep", lambda: scenario_sweep(store, sites, MONTH, SWEEP_BASE_YEARS, SWEEP_PERCENTS,
+                                                  SWEEP_PERCENTS), n_sites, "sites"),
+        ("top_month", lambda: top_months(store, sites), n_sites, "sites"),
+        ("last_six_months", lambda: trailing_sales(store, sites, MONTH, YEAR), n_sites, "sites"),
+        ("projections", projections, n_sites, "sites"),
+        ("site_reports", reports, len(sample), "reports"),
+    ]
+
+
+def run(site_counts, missing_rate, repeat, report_sites):
+    results = []
+    for n_sites in site_counts:
+        df = generate_sales(n_sites, missing_rate=missing_rate)
+        for name, fn, items, unit in stages(df, report_sites):
+            seconds, peak = measure(fn, repeat)
+            results.append({
+                "sites": n_sites,
+                "stage": name,
+                "seconds": seconds,
+                "throughput": items / seconds if seconds else float("inf"),
+                "unit": f"{unit}/s",
+                "peak_mb": peak / 2**20
+            })
+            print(f"{n_sites:>7} sites  {name:<18} {seconds * 1000:10.2f} ms  "
+                  f"{results[-1]['throughput']:14,.0f} {unit}/s  {peak / 2**20:9.1f} MB")
+    return results
+
+
+def metadata():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                  text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_revision": revision,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count()
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["sites"], r["stage"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (time ratio > 1 is slower):")
+    for r in results:
+        old = baseline.get((r["sites"], r["stage"]))
+        if old and old["seconds"]:
+            print(f"{r['sites']:>7} sites  {r['stage']:<18} {r['seconds'] / old['seconds']:6.2f}x time  "
+                  f"{r['peak_mb'] - old['peak_mb']:+9.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the fuel target pipeline")
+    parser.add_argument("--sites", default="10,100,1000,10000,50000",
+                        help="comma-separated site counts")
+    parser.add_argument("--missing-rate", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--report-sites", type=int, default=1000,
+                        help="number of site reports built per size")
+    parser.add_argument("--label", help="results file name (default: timestamp)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    site_counts = [int(s) for s in args.sites.split(",")]
+    results = run(site_counts, args.missing_rate, args.repeat, args.report_sites)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    label = args.label or datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(path, "w") as f:
+        json.dump({"meta": metadata(), "results": results}, f, indent=2)
+    print(f"\nSaved {path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+from .cache import LRUCache
+from .calculation import calc_params, fingerprint, target_year
+from .engine import (TARGET_COLUMNS, affected_months, average_growth, compute_targets,
+                     future_projection, month_targets, project_targets, refresh_target_sheet,
+                     round_up_to_thousand, scenario_sweep, site_projections, target_sheet, top_months,
+                     trailing_sales, working_day_sales)
+from .holidays import (easter_sunday, holiday_calendar, is_holiday, month_holidays, working_day_scale,
+                       working_days)
+from .ingest import (DAILY_COLUMNS, REASONS, UPLOAD_TYPES, UploadError, ValidationReport, check_daily_frame,
+                     check_frame, content_hash, detect_format, iter_frames, load_dataset, merge_upload,
+                     merged_key, parse_upload, read_store)
+from .jobs import CalculationJob
+from .profiling import (StageProfiler, cache_stats, profile_csv, profile_json, profiling, set_profiler, stage,
+                        timed_iter)
+from .reports import (historical_sales, mom_growth, report_json, report_summary, site_report,
+                      write_report_zip, yoy_growth)
+from .registry import DatasetHandle, DatasetRegistry, registry
+from .periods import (EPOCH_YEAR, MONTHS, MONTH_INDEX, horizon, lag, period_labels, split_period,
+                      to_period, trailing)
+from .store import DailySalesBuilder, SalesStore, SalesStoreBuilder
+from .synthetic import generate_sales
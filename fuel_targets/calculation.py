@@ -0,0 +1,89 @@
+import json
+
+from .cache import LRUCache
+from .engine import future_projection, month_targets, target_sheet, top_months, trailing_sales
+from .ingest import content_hash
+from .profiling import stage
+
+# Calculated dashboards keyed by a fingerprint of the dataset and parameters.
+# Shared by all sessions, so the frames in a result must not be modified.
+result_cache = LRUCache(maxsize=32)
+
+
+def calc_params(dataset_key, sites, month, year, base_years, optimistic_percent, conservative_percent,
+                mode="Per Site", window=6, working_days=False):
+    # Canonical parameters: equal inputs give equal dicts whatever types the
+    # widgets returned. Site and base year order are kept as they shape the output.
+    return {
+        "dataset_key": dataset_key,
+        "sites": tuple(str(site) for site in sites),
+        "month": month,
+        "year": int(year),
+        "base_years": tuple(int(y) for y in base_years),
+        "optimistic": float(optimistic_percent),
+        "conservative": float(conservative_percent),
+        "mode": mode,
+        "window": int(window),
+        "working_days": bool(working_days)
+    }
+
+
+def fingerprint(calc):
+    return content_hash(json.dumps(calc, sort_keys=True).encode())
+
+
+def target_year(calc):
+    # Year the targets are adjusted to, or None for unadjusted targets
+    return calc["year"] if calc["working_days"] else None
+
+
+def _targets(store, calc, result):
+    results_df, missing_sites = month_targets(store, list(calc["sites"]), calc["month"],
+                                              list(calc["base_years"]), calc["optimistic"],
+                                              calc["conservative"], calc["mode"], target_year(calc))
+    return {"results_df": results_df, "missing_sites": missing_sites}
+
+
+def _target_sheet(store, calc, result):
+    if "target_sheet" in result:
+        # Already refreshed for the months a merge touched
+        return {"target_sheet": result["target_sheet"]}
+    return {"target_sheet": target_sheet(store, list(calc["base_years"]), calc["optimistic"],
+                                         calc["conservative"], list(calc["sites"]), calc["mode"],
+                                         target_year=target_year(calc))}
+
+
+def _top_month(store, calc, result):
+    return {"top_month_df": top_months(store, list(calc["sites"]))}
+
+
+def _trend(store, calc, result):
+    return {"trend_df": trailing_sales(store, list(calc["sites"]), calc["month"], calc["year"],
+                                       calc["window"])}
+
+
+def _projections(store, calc, result):
+    future_proj, avg_growth_rate = future_projection(result["results_df"], result["trend_df"], calc["month"],
+                                                     calc["year"], calc["optimistic"], calc["conservative"],
+                                                     calc["mode"])
+    return {"future_proj": future_proj, "avg_growth_rate": avg_growth_rate}
+
+
+# (name, stage, needs targets) in run order. Each stage gets the results of
+# the earlier ones; analysis stages are skipped when no targets were found.
+STAGES = [
+    ("Targets", _targets, False),
+    ("Target Sheet", _target_sheet, False),
+    ("Top Month", _top_month, True),
+    ("Sales Trend", _trend, True),
+    ("Projections", _projections, True)
+]
+
+
+def run_stage(calc_stage, store, calc, result):
+    name, fn, needs_targets = calc_stage
+    if needs_targets and result["results_df"].empty:
+        return {}
+    with stage(f"Calculate: {name}", len(calc["sites"])):
+        return fn(store, calc, result)
+
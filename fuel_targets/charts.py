@@ -0,0 +1,205 @@
+import warnings
+from io import BytesIO
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from .cache import LRUCache
+from .profiling import stage
+
+# Rendered PNGs keyed by (chart, dataset hash, calculation parameters)
+figure_cache = LRUCache(maxsize=64)
+
+# Selections with more sites than MAX_SERIES are drawn with one of the
+# LARGE_VIEWS instead of a series per site
+MAX_SERIES = 20
+LARGE_VIEWS = ["Percentile Bands", "Top/Bottom N", "Small Multiples"]
+PAGE_SIZE = 12
+BANDS = ((10, 90), (25, 75))
+
+
+def to_png(fig, dpi=200):
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def _render(build):
+    with stage("Chart: build figure"):
+        fig = build()
+    with stage("Chart: render PNG"):
+        return to_png(fig)
+
+
+def cached_png(key, build):
+    # build() returns a Figure; it only runs when key is not cached
+    return figure_cache.get_or_create(key, lambda: _render(build))
+
+
+def percentile_bands(matrix, bands=BANDS):
+    # Median and band edges across the rows of a (sites, points) matrix,
+    # ignoring NaN; returns {percentile: values per point}
+    percentiles = sorted({p for band in bands for p in band} | {50})
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        values = np.nanpercentile(matrix, percentiles, axis=0)
+    return dict(zip(percentiles, values))
+
+
+def top_bottom(scores, n):
+    # Indices of the n highest and n lowest scores, highest first; NaN
+    # scores are left out. Small selections come back whole as the top.
+    valid = np.flatnonzero(~np.isnan(scores))
+    order = valid[np.argsort(-scores[valid], kind="stable")]
+    if len(order) <= 2 * n:
+        return order, order[:0]
+    return order[:n], order[-n:]
+
+
+def page_count(n_sites):
+    return max(1, -(-n_sites // PAGE_SIZE))
+
+
+def _page(n_sites, page):
+    start = min(page, page_count(n_sites) - 1) * PAGE_SIZE
+    return start, min(start + PAGE_SIZE, n_sites)
+
+
+def _site_lines(x, matrix, labels, title, xlabel, view, top_n=5, page=0):
+    # Large-selection version of a line chart with one series per site;
+    # matrix is (sites, len(x)) with NaN gaps
+    labels = np.asarray(labels, dtype=object)
+    positions = np.arange(len(x))
+    if view == "Small Multiples":
+        start, end = _page(len(labels), page)
+        fig = Figure(figsize=(12, 8))
+        axes = fig.subplots(3, 4, sharex=True, sharey=True).ravel()
+        for ax, label, series in zip(axes, labels[start:end], matrix[start:end]):
+            ax.plot(positions, series, marker='o', markersize=3)
+            ax.set_title(label, fontsize=9)
+        for ax in axes[end - start:]:
+            ax.set_visible(False)
+        axes[0].set_xticks(positions, x)
+        for ax in axes:
+            ax.tick_params(axis="x", labelrotation=45, labelsize=8)
+        fig.suptitle(f"{title} (sites {start + 1}-{end} of {len(labels)})")
+        fig.supxlabel(xlabel)
+        fig.supylabel("Sales (R)")
+        fig.subplots_adjust(hspace=0.35, wspace=0.1)
+        return fig
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.add_subplot()
+    if view == "Percentile Bands":
+        bands = percentile_bands(matrix)
+        for (low, high), alpha in zip(BANDS, (0.15, 0.3)):
+            ax.fill_between(positions, bands[low], bands[high], color="tab:blue", alpha=alpha,
+                            label=f"{low}th-{high}th percentile")
+        ax.plot(positions, bands[50], marker='o', color="tab:blue", label="Median")
+        ax.set_title(f"{title} ({len(labels)} sites)")
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            top, bottom = top_bottom(np.nanmean(matrix, axis=1), top_n)
+        for i in top:
+            ax.plot(positions, matrix[i], marker='o', label=labels[i])
+        for i in bottom:
+            ax.plot(positions, matrix[i], marker='o', linestyle='--', label=labels[i])
+        ax.set_title(f"{title}: top and bottom {top_n} of {len(labels)} sites")
+    ax.set_xticks(positions, x)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("Sales (R)")
+    ax.legend(fontsize=8, ncol=2)
+    return fig
+
+
+def target_comparison(results_df, mode, view=None, top_n=5, page=0):
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    if mode == "Per Site" and view == "Percentile Bands":
+        ax.boxplot(results_df.to_numpy(), labels=list(results_df.columns), whis=(10, 90), showfliers=False)
+        ax.set_title(f"Target Distribution across {len(results_df)} Sites (whiskers: 10th-90th percentile)")
+    elif mode == "Per Site" and view == "Top/Bottom N":
+        top, bottom = top_bottom(results_df["Base Target"].to_numpy(dtype=np.float64), top_n)
+        results_df.iloc[np.concatenate([top, bottom])].plot(kind='bar', ax=ax)
+        ax.set_title(f"Top and Bottom {top_n} of {len(results_df)} Sites by Base Target")
+    elif mode == "Per Site" and view == "Small Multiples":
+        start, end = _page(len(results_df), page)
+        results_df.iloc[start:end].plot(kind='bar', ax=ax)
+        ax.set_title(f"Target Comparison by Site (sites {start + 1}-{end} of {len(results_df)})")
+    elif mode == "Per Site":
+        results_df.plot(kind='bar', ax=ax)
+        ax.set_title("Target Comparison by Site")
+    else:
+        results_df.T.plot(kind='bar', ax=ax)
+        ax.set_title("Combined Target Comparison")
+    ax.set_ylabel("Sales (R)")
+    return fig
+
+
+def historical_sales(store, sites, month, base_years, mode, view=None, top_n=5, page=0):
+    sales, mask = store.month_lookup(store.rows(sites), month, base_years)
+    years = np.asarray(base_years)
+    if mode == "Per Site" and view is not None:
+        return _site_lines(years, np.where(mask, sales, np.nan), sites, f"Historical Sales for {month}",
+                           "Year", view, top_n, page)
+    if mode == "Per Site":
+        fig = Figure(figsize=(10, 6))
+        ax = fig.add_subplot()
+        for site, site_sales, site_mask in zip(sites, sales, mask):
+            ax.plot(years[site_mask], site_sales[site_mask], marker='o', label=site)
+        ax.set_title(f"Historical Sales for {month}")
+        ax.legend()
+    else:
+        fig = Figure(figsize=(8, 4))
+        ax = fig.add_subplot()
+        ax.plot(years, np.where(mask.all(axis=0), sales.sum(axis=0), np.nan), marker='o')
+        ax.set_title(f"Combined Historical Sales for {month}")
+    ax.set_xlabel("Year")
+    ax.set_ylabel("Sales (R)")
+    return fig
+
+
+def sales_trend(trend_df, view=None, top_n=5, page=0):
+    if view is not None:
+        return _site_lines(list(trend_df.index), trend_df.to_numpy(dtype=np.float64).T, list(trend_df.columns),
+                           f"Last {len(trend_df)} Months Sales Trend", "Month", view, top_n, page)
+    fig = Figure(figsize=(12, 6))
+    ax = fig.add_subplot()
+    for site in trend_df.columns:
+        ax.plot(trend_df.index, trend_df[site], marker='o', label=site)
+    ax.set_title(f"Last {len(trend_df)} Months Sales Trend")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Sales (R)")
+    ax.legend()
+    return fig
+
+
+def projections(future_proj):
+    fig = Figure(figsize=(12, 6))
+    ax = fig.add_subplot()
+    ax.plot(future_proj["Month"], future_proj["Projected"], marker='o', label="Projected Target")
+    ax.plot(future_proj["Month"], future_proj["Optimistic"], linestyle="--", label="Optimistic")
+    ax.plot(future_proj["Month"], future_proj["Conservative"], linestyle=":", label="Conservative")
+    ax.set_title("Sales Projections")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Sales (R)")
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.legend()
+    return fig
+
+
+def sweep_heatmap(sweep_df):
+    # Network Optimistic and Conservative totals against each base year set
+    fig = Figure(figsize=(12, 1.5 + 0.5 * sweep_df.index.levshape[0]))
+    for ax, column, level in zip(fig.subplots(1, 2), ["Optimistic", "Conservative"],
+                                 ["Optimistic %", "Conservative %"]):
+        grid = sweep_df[column].groupby(level=["Base Years", level], sort=False).first().unstack(level)
+        image = ax.imshow(grid.to_numpy() / 1e6, aspect="auto", cmap="viridis")
+        ax.set_xticks(range(grid.shape[1]), [f"{p:g}" for p in grid.columns], rotation=45)
+        ax.set_yticks(range(grid.shape[0]), grid.index)
+        ax.set_xlabel(level)
+        ax.set_title(f"{column} Target (R million)")
+        fig.colorbar(image, ax=ax)
+    fig.tight_layout()
+    return fig
@@ -0,0 +1,179 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .engine import (future_projection, month_targets, site_projections, target_sheet,
+                     top_months, trailing_sales)
+from .ingest import UploadError, detect_format, read_store
+from .periods import MONTHS
+from .profiling import StageProfiler, profile_json, profiling, stage
+from .reports import report_summary, write_report_zip
+from .synthetic import DEFAULT_YEARS, generate_sales
+
+
+def _base_years(text):
+    try:
+        return [int(s.strip()) for s in text.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("use comma-separated integers, e.g. 2021,2022,2024")
+
+
+def write_frame(df, path, index=True):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        df.to_parquet(path, index=index)
+    elif ext in (".feather", ".arrow", ".ipc"):
+        df.reset_index(drop=not index).to_feather(path)
+    else:
+        df.to_csv(path, index=index)
+
+
+def _target_year(args, year):
+    return year if args.working_days else None
+
+
+def _site_chunk(store, args, month, year):
+    # Worker body: everything that can be computed one site at a time
+    sheet = target_sheet(store, args.base_years, args.optimistic, args.conservative,
+                         target_year=_target_year(args, year))
+    top = top_months(store, store.sites)
+    projections = site_projections(store, store.sites, month, year, args.base_years,
+                                   args.optimistic, args.conservative, args.months_ahead, args.window,
+                                   _target_year(args, year))
+    return sheet, top, projections
+
+
+def _run_per_site(store, args, month, year):
+    chunks = [rows for rows in np.array_split(np.arange(len(store)), max(args.workers * 4, 1)) if rows.size]
+    if args.workers <= 1 or len(chunks) <= 1:
+        parts = [_site_chunk(store.subset(rows), args, month, year) for rows in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(_site_chunk, store.subset(rows), args, month, year) for rows in chunks]
+            parts = [future.result() for future in futures]
+    if not parts:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    sheets, tops, projections = zip(*parts)
+    return pd.concat(sheets), pd.concat(tops), pd.concat(projections, ignore_index=True)
+
+
+def _run_combined(store, args, month, year):
+    # The Combined rule needs every site at once, so it stays in-process
+    sheet = target_sheet(store, args.base_years, args.optimistic, args.conservative, mode="Combined",
+                         target_year=_target_year(args, year))
+    results_df, _ = month_targets(store, store.sites, month, args.base_years,
+                                  args.optimistic, args.conservative, "Combined", _target_year(args, year))
+    projections = pd.DataFrame(columns=["Month", "Projected", "Optimistic", "Conservative"])
+    if not results_df.empty:
+        trend_df = trailing_sales(store, store.sites, month, year, args.window)
+        projections, _ = future_projection(results_df, trend_df, month, year, args.optimistic,
+                                           args.conservative, "Combined", args.months_ahead)
+    return sheet, top_months(store, store.sites), projections
+
+
+def run_targets(args):
+    if not args.profile:
+        return _targets(args)
+    # Worker processes are timed as a whole under "Targets: compute"
+    with profiling(StageProfiler(track_memory=True)) as profiler:
+        _targets(args)
+    with open(args.profile, "w") as f:
+        f.write(profile_json(profiler))
+    print(f"Wrote stage profile to {args.profile}")
+
+
+def _targets(args):
+    store = read_store(args.input, args.format or detect_format(args.input))
+    if store.latest() is None:
+        raise UploadError(f"No sales data found in {args.input}")
+    month, year = args.month, args.year
+    if month is None or year is None:
+        latest_month, latest_year = store.latest()
+        month, year = month or latest_month, year or latest_year
+
+    with stage("Targets: compute", len(store)):
+        if args.mode == "combined":
+            sheet, top, projections = _run_combined(store, args, month, year)
+        else:
+            sheet, top, projections = _run_per_site(store, args, month, year)
+
+    write_frame(sheet, args.out)
+    if args.top_month_out:
+        write_frame(top.rename_axis("Site"), args.top_month_out)
+    if args.projections_out:
+        write_frame(projections, args.projections_out, index=False)
+    if args.reports_out or args.report_summary_out:
+        mode = "Combined" if args.mode == "combined" else "Per Site"
+        results_df, _ = month_targets(store, store.sites, month, args.base_years,
+                                      args.optimistic, args.conservative, mode, _target_year(args, year))
+        summary = report_summary(store, results_df, store.sites, month, year, args.base_years)
+        if args.report_summary_out:
+            write_frame(summary, args.report_summary_out)
+        if args.reports_out:
+            with stage("Reports: write ZIP", len(summary)), open(args.reports_out, "wb") as f:
+                write_report_zip(f, summary, month, year, args.base_years)
+    print(f"Wrote targets for {len(store)} sites to {args.out}")
+
+
+def run_generate(args):
+    df = generate_sales(args.sites, range(args.first_year, args.first_year + args.years),
+                        args.missing_rate, args.seed)
+    write_frame(df, args.out, index=False)
+    print(f"Wrote {len(df)} rows for {args.sites} sites to {args.out}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m fuel_targets",
+                                     description="Headless fuel sales target calculations")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    targets = commands.add_parser("targets", help="full-year targets for every site")
+    targets.add_argument("--input", required=True,
+                         help="sales history (CSV, Parquet or Arrow), monthly or daily rows")
+    targets.add_argument("--format", choices=["csv", "parquet", "arrow"],
+                         help="input format (default: from the file extension)")
+    targets.add_argument("--base-years", type=_base_years, default=[2021, 2022, 2024])
+    targets.add_argument("--optimistic", type=float, default=5.0, help="optimistic %% boost")
+    targets.add_argument("--conservative", type=float, default=10.0, help="conservative %% buffer")
+    targets.add_argument("--mode", choices=["per-site", "combined"], default="per-site")
+    targets.add_argument("--month", choices=MONTHS,
+                         help="month the projections start from (default: latest in the data)")
+    targets.add_argument("--year", type=int)
+    targets.add_argument("--months-ahead", type=int, default=6)
+    targets.add_argument("--window", type=int, default=6,
+                         help="trailing months used for the growth rate")
+    targets.add_argument("--working-days", action="store_true",
+                         help="scale base years to --year's working days (weekdays less public holidays)")
+    targets.add_argument("--out", required=True, help="target sheet (.parquet, .csv or .feather)")
+    targets.add_argument("--top-month-out", help="optional top month per site")
+    targets.add_argument("--projections-out", help="optional future projections")
+    targets.add_argument("--reports-out", help="optional ZIP of every site's JSON report for --month")
+    targets.add_argument("--report-summary-out", help="optional one-row-per-site report summary")
+    targets.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    targets.add_argument("--profile", help="optional JSON of per-stage timings, peak memory and cache hit rates")
+    targets.set_defaults(func=run_targets)
+
+    generate = commands.add_parser("generate", help="synthetic sales history for testing")
+    generate.add_argument("--sites", type=int, default=100)
+    generate.add_argument("--first-year", type=int, default=DEFAULT_YEARS[0])
+    generate.add_argument("--years", type=int, default=len(DEFAULT_YEARS))
+    generate.add_argument("--missing-rate", type=float, default=0.05,
+                          help="share of site-months left out")
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--out", required=True, help="output file (.csv, .parquet or .feather)")
+    generate.set_defaults(func=run_generate)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        args.func(args)
+    except (UploadError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
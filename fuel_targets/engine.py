@@ -0,0 +1,265 @@
+import numpy as np
+import pandas as pd
+
+from .holidays import working_day_scale, working_days
+from .periods import (MONTH_INDEX, MONTHS, horizon, period_labels, period_month, period_year,
+                      to_period, trailing)
+
+TARGET_COLUMNS = ["Base Target", "Optimistic", "Conservative"]
+
+
+def round_up_to_thousand(x):
+    return np.ceil(np.asarray(x, dtype=np.float64) / 1000) * 1000
+
+
+def base_year_sales(store, rows, base_years, months=None, target_year=None):
+    # Sales and mask shaped (sites, base years, months) for the given months
+    # (all twelve by default). Missing cells read as 0 and are False in mask.
+    # With a target_year each base year is scaled to that year's working days
+    # in the same month.
+    month_idx = np.arange(12) if months is None else np.array([MONTH_INDEX[m] for m in months])
+    years = np.asarray(base_years, dtype=np.int64)
+    periods = to_period(years[:, None], month_idx[None, :])
+    values, mask = store.lookup(rows, periods.ravel())
+    mask &= ~np.isnan(values)
+    values = np.where(mask, values, 0.0)
+    shape = (len(rows), len(years), len(month_idx))
+    values = values.reshape(shape)
+    if target_year is not None:
+        values = values * working_day_scale(years, month_idx, target_year)[None]
+    return values, mask.reshape(shape)
+
+
+def per_site_base(values, mask):
+    # Mean over the base years each site has data for; NaN if it has none
+    counts = mask.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, values.sum(axis=1) / counts, np.nan)
+
+
+def combined_base(values, mask):
+    # Network total averaged over the base years in which every selected site
+    # has data; a year with any gap is dropped. Shape (1, months).
+    valid = mask.all(axis=0)
+    counts = valid.sum(axis=0)
+    totals = np.where(valid, values.sum(axis=0), 0.0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, totals / counts, np.nan)[None, :]
+
+
+def scenario_targets(base, optimistic_percent, conservative_percent):
+    # Stacks Base/Optimistic/Conservative on a trailing axis, rounded up to
+    # the next thousand. NaN bases stay NaN.
+    return round_up_to_thousand(np.stack([
+        base,
+        base * (1 + optimistic_percent/100),
+        base * (1 - conservative_percent/100)
+    ], axis=-1))
+
+
+def compute_targets(store, rows, base_years, optimistic_percent, conservative_percent,
+                    mode="Per Site", months=None, target_year=None):
+    # Targets shaped (sites, months, 3), or (1, months, 3) in Combined mode;
+    # target_year gives working-day adjusted targets for that year
+    values, mask = base_year_sales(store, rows, base_years, months, target_year)
+    base = per_site_base(values, mask) if mode == "Per Site" else combined_base(values, mask)
+    return scenario_targets(base, optimistic_percent, conservative_percent)
+
+
+def _target_frame(targets, index):
+    available = ~np.isnan(targets[:, 0])
+    return pd.DataFrame(targets[available].astype(np.int64), index=index[available], columns=TARGET_COLUMNS)
+
+
+def month_targets(store, sites, month, base_years, optimistic_percent, conservative_percent,
+                  mode="Per Site", target_year=None):
+    # Single-month results as shown on the dashboard, plus the sites that had
+    # no base-year data (Per Site) or an empty frame (Combined).
+    targets = compute_targets(store, store.rows(sites), base_years, optimistic_percent,
+                              conservative_percent, mode, [month], target_year)[:, 0, :]
+    if mode == "Per Site":
+        index = pd.Index(sites)
+        missing = [site for site, ok in zip(sites, ~np.isnan(targets[:, 0])) if not ok]
+    else:
+        index = pd.Index(["Combined"])
+        missing = []
+    return _target_frame(targets, index), missing
+
+
+def target_sheet(store, base_years, optimistic_percent, conservative_percent, sites=None,
+                 mode="Per Site", months=None, target_year=None):
+    # Full-year (or the given months') target sheet indexed by (Site, Month);
+    # sites without data for a month are left out of that month.
+    sites = store.sites if sites is None else list(sites)
+    months = MONTHS if months is None else list(months)
+    targets = compute_targets(store, store.rows(sites), base_years, optimistic_percent,
+                              conservative_percent, mode, months, target_year)
+    labels = sites if mode == "Per Site" else ["Combined"]
+    index = pd.MultiIndex.from_product([labels, months], names=["Site", "Month"])
+    return _target_frame(targets.reshape(-1, 3), index)
+
+
+def affected_months(periods, base_years):
+    # Months whose targets depend on any of the given periods
+    periods = np.asarray(periods)
+    relevant = periods[np.isin(period_year(periods), list(base_years))]
+    return [month for month in MONTHS if month in set(period_month(relevant))]
+
+
+def refresh_target_sheet(sheet, store, periods, base_years, optimistic_percent, conservative_percent,
+                         sites=None, mode="Per Site", target_year=None):
+    # Recomputes only the months of a target sheet that a merge touched
+    months = affected_months(periods, base_years)
+    if not months:
+        return sheet
+    fresh = target_sheet(store, base_years, optimistic_percent, conservative_percent, sites, mode, months,
+                         target_year)
+    kept = sheet[~sheet.index.get_level_values("Month").isin(months)]
+    labels = (store.sites if sites is None else list(sites)) if mode == "Per Site" else ["Combined"]
+    order = pd.MultiIndex.from_product([labels, MONTHS], names=["Site", "Month"])
+    return pd.concat([kept, fresh]).reindex(order).dropna().astype(np.int64)
+
+
+def scenario_sweep(store, sites, month, base_year_sets, optimistic_values, conservative_values,
+                   mode="Per Site", target_year=None):
+    # Targets for every (base years, optimistic %, conservative %) combination,
+    # summed over the sites (or the Combined row). The month's sales are read
+    # once for all base years; each set weights those years by how often it
+    # lists them.
+    if not base_year_sets or not all(len(base_years) for base_years in base_year_sets):
+        raise ValueError("every base year set needs at least one year")
+    years = sorted({int(y) for base_years in base_year_sets for y in base_years})
+    values, mask = base_year_sales(store, store.rows(sites), years, [month], target_year)
+    values, mask = values[:, :, 0], mask[:, :, 0]
+    # A year listed twice counts twice, as in compute_targets
+    weights = np.array([[[int(y) for y in base_years].count(year) for year in years]
+                        for base_years in base_year_sets], dtype=np.float64)
+    if mode != "Per Site":
+        valid = mask.all(axis=0)
+        values, mask = np.where(valid, values.sum(axis=0), 0.0)[None, :], valid[None, :]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        base = values @ weights.T / (mask @ weights.T)
+
+    optimistic = np.asarray(optimistic_values, dtype=np.float64)
+    conservative = np.asarray(conservative_values, dtype=np.float64)
+    totals = np.nansum(round_up_to_thousand(base), axis=0)
+    opt_totals = np.nansum(round_up_to_thousand(base[:, :, None] * (1 + optimistic/100)), axis=0)
+    cons_totals = np.nansum(round_up_to_thousand(base[:, :, None] * (1 - conservative/100)), axis=0)
+
+    shape = (len(base_year_sets), len(optimistic), len(conservative))
+    labels = [", ".join(str(int(y)) for y in base_years) for base_years in base_year_sets]
+    index = pd.MultiIndex.from_product([labels, optimistic, conservative],
+                                       names=["Base Years", "Optimistic %", "Conservative %"])
+    return pd.DataFrame({
+        "Sites": np.broadcast_to((~np.isnan(base)).sum(axis=0)[:, None, None], shape).ravel(),
+        "Base Target": np.broadcast_to(totals[:, None, None], shape).ravel().astype(np.int64),
+        "Optimistic": np.broadcast_to(opt_totals[:, :, None], shape).ravel().astype(np.int64),
+        "Conservative": np.broadcast_to(cons_totals[:, None, :], shape).ravel().astype(np.int64)
+    }, index=index)
+
+
+def working_day_sales(store, sites, month, years, target_year):
+    # Selected sites' total sales for one month of each year next to that
+    # month's working days, per working day and scaled to target_year's
+    # working days (the figures behind working-day adjusted targets)
+    years = [int(y) for y in years]
+    values, mask = base_year_sales(store, store.rows(sites), years, [month])
+    days = working_days(to_period(np.asarray(years), month))
+    target_days = working_days(to_period(target_year, month))
+    sales = values[:, :, 0].sum(axis=0)
+    reported = mask[:, :, 0].any(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        per_day = np.where(reported & (days > 0), sales / days, np.nan)
+    return pd.DataFrame({
+        "Working Days": days,
+        "Sales": np.where(reported, sales, np.nan),
+        "Sales per Working Day": per_day,
+        f"Adjusted to {target_year}": per_day * target_days
+    }, index=pd.Index(years, name="Year"))
+
+
+def top_months(store, sites):
+    # Best month per site from the store's statistics index; sites with no
+    # positive sales show " 0" and 0 as the old scan did.
+    rows = store.rows(sites)
+    period = store.stats.peak_period[rows]
+    sales = store.stats.peak_sales[rows]
+    has_peak = sales > 0
+    labels = np.array(period_labels(store.periods) or [""], dtype=object)
+    return pd.DataFrame({
+        "Month": pd.Categorical(np.where(has_peak, labels[np.where(has_peak, period, 0)], " 0")),
+        "Sales": np.where(has_peak, sales, 0).astype(store.values.dtype)
+    }, index=list(sites))
+
+
+def trailing_sales(store, sites, selected_month, selected_year, window=6):
+    # Sales of the `window` months up to the selected one, one column per
+    # site in the store's sales dtype; missing months read as 0.
+    last = to_period(selected_year, selected_month)
+    sales, _ = store.trailing(store.rows(sites), last, window)
+    periods = trailing(last, window)
+    # Month names are unique up to a year; longer windows need the year too
+    index = period_month(periods) if window <= 12 else period_labels(periods)
+    return pd.DataFrame(sales.T.astype(store.values.dtype), index=index, columns=list(sites))
+
+
+def average_growth(sales):
+    # Mean month-on-month growth (as a fraction) of each column of a
+    # (months, sites) array. Steps from a zero month are ignored.
+    sales = np.asarray(sales, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        growth = sales[1:] / sales[:-1] - 1
+    growth[~np.isfinite(growth)] = np.nan
+    counts = (~np.isnan(growth)).sum(axis=0)
+    return np.where(counts > 0, np.nansum(growth, axis=0) / np.maximum(counts, 1), np.nan)
+
+
+def project_targets(base_target, growth_rate, optimistic_percent, conservative_percent, months_ahead=6):
+    # Compounds the base target forward; arrays broadcast to (..., months_ahead)
+    steps = np.arange(1, months_ahead + 1)
+    projected = np.asarray(base_target, dtype=np.float64)[..., None] * \
+        (1 + np.asarray(growth_rate, dtype=np.float64)[..., None]) ** steps
+    return (np.round(projected),
+            np.round(projected * (1 + optimistic_percent/100)),
+            np.round(projected * (1 - conservative_percent/100)))
+
+
+def future_projection(results_df, trend_df, selected_month, selected_year,
+                      optimistic_percent, conservative_percent, mode="Per Site", months_ahead=6):
+    # Dashboard projection: the mean base target grown at the mean MoM rate of
+    # the selected sites (or of their combined total). Returns (frame, rate).
+    sales = trend_df.to_numpy() if mode == "Per Site" else trend_df.sum(axis=1).to_numpy()[:, None]
+    site_growth = average_growth(sales)
+    site_growth = site_growth[~np.isnan(site_growth)]
+    avg_growth_rate = float(site_growth.mean()) if site_growth.size else 0.0
+    base_target = results_df["Base Target"].mean()
+    projected, optimistic, conservative = project_targets(
+        base_target, avg_growth_rate, optimistic_percent, conservative_percent, months_ahead)
+    return pd.DataFrame({
+        "Month": period_labels(horizon(to_period(selected_year, selected_month), months_ahead)),
+        "Projected": projected.astype(np.int64),
+        "Optimistic": optimistic.astype(np.int64),
+        "Conservative": conservative.astype(np.int64)
+    }), avg_growth_rate
+
+
+def site_projections(store, sites, selected_month, selected_year, base_years,
+                     optimistic_percent, conservative_percent, months_ahead=6, window=6, target_year=None):
+    # Per-site version of the dashboard projection: each site's base target
+    # for the selected month grown at its own average MoM rate. Long format,
+    # one row per site and future month.
+    targets = compute_targets(store, store.rows(sites), base_years, optimistic_percent,
+                              conservative_percent, months=[selected_month], target_year=target_year)[:, 0, 0]
+    growth = average_growth(trailing_sales(store, sites, selected_month, selected_year, window).to_numpy())
+    growth = np.where(np.isnan(growth), 0.0, growth)
+    available = ~np.isnan(targets)
+    projected, optimistic, conservative = project_targets(
+        targets[available], growth[available], optimistic_percent, conservative_percent, months_ahead)
+    labels = period_labels(horizon(to_period(selected_year, selected_month), months_ahead))
+    return pd.DataFrame({
+        "Site": np.repeat(np.asarray(sites, dtype=object)[available], months_ahead),
+        "Month": np.tile(labels, int(available.sum())),
+        "Projected": projected.ravel().astype(np.int64),
+        "Optimistic": optimistic.ravel().astype(np.int64),
+        "Conservative": conservative.ravel().astype(np.int64)
+    })
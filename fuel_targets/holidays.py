@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+from .cache import LRUCache
+from .periods import MONTH_INDEX, period_year, to_period
+
+# South African public holidays (Public Holidays Act): fixed dates plus Good
+# Friday and Family Day, two days before and one day after Easter Sunday. A
+# holiday on a Sunday is also observed on the Monday after it. One-off days
+# proclaimed for elections and the like are not included.
+FIXED_HOLIDAYS = [
+    (1, 1, "New Year's Day"),
+    (3, 21, "Human Rights Day"),
+    (4, 27, "Freedom Day"),
+    (5, 1, "Workers' Day"),
+    (6, 16, "Youth Day"),
+    (8, 9, "National Women's Day"),
+    (9, 24, "Heritage Day"),
+    (12, 16, "Day of Reconciliation"),
+    (12, 25, "Christmas Day"),
+    (12, 26, "Day of Goodwill")
+]
+EASTER_HOLIDAYS = [(-2, "Good Friday"), (1, "Family Day")]
+
+# Working days are Monday to Friday that are not public holidays
+WEEKMASK = "1111100"
+
+# Calendars by (first year, last year), shared by all sessions
+calendar_cache = LRUCache(maxsize=16)
+
+
+def _dates(years, months, days):
+    # datetime64[D] from arrays of years, 1-based months and days
+    years = np.asarray(years, dtype=np.int64)
+    months = (years - 1970) * 12 + np.asarray(months, dtype=np.int64) - 1
+    return months.astype("datetime64[M]").astype("datetime64[D]") + (np.asarray(days, dtype=np.int64) - 1)
+
+
+def easter_sunday(years):
+    # Gregorian Easter Sunday for each year (anonymous Gregorian algorithm)
+    y = np.asarray(years, dtype=np.int64)
+    a, b, c = y % 19, y // 100, y % 100
+    d, e = b // 4, b % 4
+    g = (b - (b + 8) // 25 + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    n = h + l - 7 * m + 114
+    return _dates(y, n // 31, n % 31 + 1)
+
+
+def _build_calendar(first_year, last_year):
+    years = np.arange(first_year, last_year + 1)
+    dates, names = [], []
+    for month, day, name in FIXED_HOLIDAYS:
+        dates.append(_dates(years, month, day))
+        names.append(np.full(len(years), name, dtype=object))
+    easter = easter_sunday(years)
+    for offset, name in EASTER_HOLIDAYS:
+        dates.append(easter + offset)
+        names.append(np.full(len(years), name, dtype=object))
+    dates, names = np.concatenate(dates), np.concatenate(names)
+
+    # numpy weekdays count Monday as 0, so Sunday is 6
+    sunday = (dates.astype(np.int64) + 3) % 7 == 6
+    observed = dates[sunday] + 1
+    fresh = ~np.isin(observed, dates)
+    dates = np.concatenate([dates, observed[fresh]])
+    names = np.concatenate([names, names[sunday][fresh] + " observed"])
+
+    order = np.argsort(dates, kind="stable")
+    holidays = pd.Series(names[order], index=pd.DatetimeIndex(dates[order], name="Date"), name="Holiday")
+    return holidays, np.busdaycalendar(weekmask=WEEKMASK, holidays=dates)
+
+
+def _calendar(first_year, last_year):
+    return calendar_cache.get_or_create((int(first_year), int(last_year)),
+                                        lambda: _build_calendar(int(first_year), int(last_year)))
+
+
+def holiday_calendar(first_year, last_year=None):
+    # Holiday names indexed by date for the given years
+    return _calendar(first_year, first_year if last_year is None else last_year)[0]
+
+
+def month_holidays(year, month):
+    # Holidays falling in one month, by month name ("Jan") or 0-based index
+    month = MONTH_INDEX[month] if isinstance(month, str) else int(month)
+    holidays = holiday_calendar(year)
+    return holidays[holidays.index.month == month + 1]
+
+
+def is_holiday(dates):
+    dates = pd.DatetimeIndex(np.atleast_1d(np.asarray(dates, dtype="datetime64[D]")))
+    if dates.empty:
+        return np.zeros(0, dtype=bool)
+    holidays = holiday_calendar(dates.year.min(), dates.year.max())
+    return dates.isin(holidays.index)
+
+
+def working_days(periods):
+    # Working days in each period (see periods), as int64
+    periods = np.asarray(periods, dtype=np.int64)
+    if periods.size == 0:
+        return np.zeros(periods.shape, dtype=np.int64)
+    years = period_year(periods)
+    _, busdays = _calendar(years.min(), years.max())
+    starts = periods.astype("datetime64[M]").astype("datetime64[D]")
+    ends = (periods + 1).astype("datetime64[M]").astype("datetime64[D]")
+    return np.busday_count(starts, ends, busdaycal=busdays).astype(np.int64)
+
+
+def working_day_scale(base_years, months, target_year):
+    # (base years, months) factors that scale each base year's sales to the
+    # target year's working days in the same month
+    month_idx = np.array([MONTH_INDEX[m] if isinstance(m, str) else int(m) for m in months])
+    base = working_days(to_period(np.asarray(base_years, dtype=np.int64)[:, None], month_idx[None, :]))
+    target = working_days(to_period(target_year, month_idx))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(base > 0, target[None, :] / base, 1.0)
@@ -0,0 +1,342 @@
+import hashlib
+import os
+from io import BytesIO
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from .periods import MONTH_INDEX, MONTHS
+from .profiling import stage, timed_iter
+from .registry import registry
+from .store import DailySalesBuilder, SalesStoreBuilder
+
+REQUIRED_COLUMNS = {"Year", "Month", "Sales", "Site"}
+# Daily point-of-sale exports, resampled to monthly totals on load
+DAILY_COLUMNS = {"Date", "Sales", "Site"}
+UPLOAD_TYPES = ["csv", "parquet", "arrow", "feather", "ipc"]
+TEXT_COLUMNS = {"Site": str, "Month": str}
+CHUNK_ROWS = 250_000
+YEAR_RANGE = (1900, 2100)
+# Quarantined rows kept for display; reasons are counted over every row
+MAX_REPORTED_ROWS = 10_000
+
+# Row-level checks in the order they are reported; a row gets the first
+# reason it fails. Repeats are found while folding, so only clean rows count.
+REASONS = {
+    "site": "Site is missing",
+    "year": "Year is missing or not a whole number",
+    "year_range": f"Year is outside {YEAR_RANGE[0]}-{YEAR_RANGE[1]}",
+    "month": "Month is not one of Jan-Dec",
+    "date": "Date is missing or not a date",
+    "sales": "Sales is missing or not numeric",
+    "negative": "Sales is negative",
+    "repeated_month": "Repeats an earlier row's Site, Year and Month",
+    "repeated_day": "Repeats an earlier row's Site and Date"
+}
+REASON_CODES = {key: code for code, key in enumerate(REASONS)}
+
+
+class UploadError(ValueError):
+    pass
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def detect_format(name=None, head=b""):
+    ext = os.path.splitext(name or "")[1].lower().lstrip(".")
+    if ext == "parquet" or head[:4] == b"PAR1":
+        return "parquet"
+    if ext in ("arrow", "feather", "ipc") or head[:6] == b"ARROW1":
+        return "arrow"
+    return "csv"
+
+
+def _is_text(column):
+    dtype = column.cat.categories.dtype if isinstance(column.dtype, pd.CategoricalDtype) else column.dtype
+    return pd.api.types.is_string_dtype(dtype)
+
+
+def validate_frame(df):
+    # Structural problems reject the whole file; bad values only their rows.
+    # Returns True for daily rows (a Date column instead of Year and Month).
+    if REQUIRED_COLUMNS.issubset(df.columns):
+        return False
+    if DAILY_COLUMNS.issubset(df.columns):
+        return True
+    expected = DAILY_COLUMNS if "Date" in df.columns else REQUIRED_COLUMNS
+    raise UploadError(f"Missing required columns: {expected - set(df.columns)}")
+
+
+def _numeric(column):
+    if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+        return column.to_numpy(dtype=np.float64, na_value=np.nan)
+    return pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _month_codes(column):
+    # Month index per row, -1 where the name is not one of MONTHS. Only the
+    # distinct values are looked up.
+    if isinstance(column.dtype, pd.CategoricalDtype) and list(column.cat.categories) == MONTHS:
+        return column.cat.codes.to_numpy(dtype=np.int64)
+    codes, uniques = pd.factorize(column)
+    lookup = np.array([MONTH_INDEX.get(m, -1) if isinstance(m, str) else -1 for m in uniques] + [-1],
+                      dtype=np.int64)
+    return lookup[codes]
+
+
+def _dates(column):
+    # datetime64[D] per row, NaT where unparseable. Every site repeats the
+    # same dates, so only the distinct values are parsed.
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column.to_numpy(dtype="datetime64[D]")
+    codes, uniques = pd.factorize(column)
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), errors="coerce").to_numpy(dtype="datetime64[D]")
+    return np.append(parsed, np.datetime64("NaT", "D"))[codes]
+
+
+def _site_codes(column):
+    # Codes into the distinct site names, and whether each row's site is
+    # missing or blank
+    codes, uniques = pd.factorize(column)
+    blank = np.array([not str(site).strip() for site in uniques] + [True], dtype=bool)
+    return codes, pd.Index(np.asarray(uniques)), blank[codes]
+
+
+def _first_failure(checks):
+    # Code of the first (reason key, failed) check each row fails, -1 if none
+    return np.select([failed for _, failed in checks], [REASON_CODES[key] for key, _ in checks], default=-1)
+
+
+def check_frame(df):
+    # One vectorised pass over a validated chunk. Returns the clean rows in
+    # the dtypes they are folded with (int16 Year, categorical Site and Month,
+    # so each distinct name is held once) and a reason code per row, -1 for
+    # clean rows.
+    site_codes, sites, site_missing = _site_codes(df["Site"])
+    years = _numeric(df["Year"])
+    month_codes = _month_codes(df["Month"])
+    sales = _numeric(df["Sales"])
+    with np.errstate(invalid="ignore"):
+        reasons = _first_failure([
+            ("site", site_missing),
+            ("year", ~np.isfinite(years) | (years != np.floor(years))),
+            ("year_range", (years < YEAR_RANGE[0]) | (years > YEAR_RANGE[1])),
+            ("month", month_codes < 0),
+            ("sales", ~np.isfinite(sales)),
+            ("negative", sales < 0)
+        ])
+    clean = reasons < 0
+    frame = pd.DataFrame({
+        "Year": years[clean].astype(np.int16),
+        "Month": pd.Categorical.from_codes(month_codes[clean], MONTHS),
+        "Sales": sales[clean],
+        "Site": pd.Categorical.from_codes(site_codes[clean], sites)
+    }, index=df.index[clean])
+    return frame, reasons
+
+
+def check_daily_frame(df):
+    # check_frame for daily rows. The clean rows come back as Period (see
+    # periods), Day of the month, Sales and categorical Site.
+    site_codes, sites, site_missing = _site_codes(df["Site"])
+    dates = _dates(df["Date"])
+    months = dates.astype("datetime64[M]")
+    periods = months.astype(np.int64)
+    days = (dates - months.astype("datetime64[D]")).astype(np.int64) + 1
+    years = 1970 + periods // 12
+    sales = _numeric(df["Sales"])
+    with np.errstate(invalid="ignore"):
+        reasons = _first_failure([
+            ("site", site_missing),
+            ("date", np.isnat(dates)),
+            ("year_range", (years < YEAR_RANGE[0]) | (years > YEAR_RANGE[1])),
+            ("sales", ~np.isfinite(sales)),
+            ("negative", sales < 0)
+        ])
+    clean = reasons < 0
+    frame = pd.DataFrame({
+        "Period": periods[clean].astype(np.int32),
+        "Day": days[clean].astype(np.int8),
+        "Sales": sales[clean],
+        "Site": pd.Categorical.from_codes(site_codes[clean], sites)
+    }, index=df.index[clean])
+    return frame, reasons
+
+
+class ValidationReport:
+    # Rows quarantined while reading a file: how many failed each check, and
+    # the first MAX_REPORTED_ROWS of them as they appeared in the file.
+    # Row numbers count data rows from 1, not counting the header.
+
+    def __init__(self, limit=MAX_REPORTED_ROWS):
+        self.limit = limit
+        self.rows = 0
+        self.counts = np.zeros(len(REASONS), dtype=np.int64)
+        self._samples = []
+        self._kept = 0
+
+    def add(self, df, offset, reasons):
+        # df is a chunk starting at data row offset; reasons as from check_frame
+        self.rows = offset + len(df)
+        bad = np.flatnonzero(reasons >= 0)
+        self.counts += np.bincount(reasons[bad], minlength=len(REASONS))
+        take = bad[:self.limit - self._kept]
+        if take.size:
+            columns = ["Site", "Date", "Sales"] if "Year" not in df.columns else ["Site", "Year", "Month", "Sales"]
+            sample = df.iloc[take][columns].astype(object)
+            sample.insert(0, "Row", offset + take + 1)
+            sample["Reason"] = np.array(list(REASONS.values()), dtype=object)[reasons[take]]
+            self._samples.append(sample)
+            self._kept += take.size
+
+    @property
+    def quarantined(self):
+        return int(self.counts.sum())
+
+    def summary(self):
+        counts = pd.Series(self.counts, index=pd.Index(list(REASONS.values()), name="Reason"), name="Rows")
+        return counts[counts > 0].to_frame()
+
+    def table(self):
+        if not self._samples:
+            return pd.DataFrame(columns=["Row", "Site", "Sales", "Reason"])
+        return pd.concat(self._samples, ignore_index=True)
+
+    def describe(self):
+        return "; ".join(f"{reason}: {rows}" for reason, rows in self.summary()["Rows"].items())
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise UploadError("Parquet and Arrow uploads require the pyarrow package")
+    return pyarrow
+
+
+def _text_sites(pa, batch):
+    # Site as text, as read_csv reads it, whatever type the file stores it in
+    if "Site" not in batch.schema.names:
+        return batch
+    i = batch.schema.get_field_index("Site")
+    column = batch.column(i)
+    kind = column.type.value_type if pa.types.is_dictionary(column.type) else column.type
+    if pa.types.is_string(kind) or pa.types.is_large_string(kind):
+        return batch
+    columns = list(batch.columns)
+    columns[i] = column.cast(pa.string())
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+
+def _arrow_batches(pa, source):
+    if isinstance(source, (str, os.PathLike)):
+        source = pa.memory_map(os.fspath(source))
+    try:
+        reader = pa.ipc.open_file(source)
+        return (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        return pa.ipc.open_stream(source)
+
+
+def iter_frames(source, fmt="csv", chunk_rows=CHUNK_ROWS):
+    # Yields DataFrames of at most chunk_rows rows. source is a path or a
+    # binary file object; Parquet and Arrow files on disk are memory-mapped.
+    # Site and Month are read as text: inferring them per chunk would give the
+    # same site different names depending on where the chunks split.
+    if fmt == "csv":
+        yield from pd.read_csv(source, chunksize=chunk_rows, dtype=TEXT_COLUMNS)
+    elif fmt == "parquet":
+        pa = _import_pyarrow()
+        parquet_file = pa.parquet.ParquetFile(source, memory_map=isinstance(source, (str, os.PathLike)))
+        columns = [c for c in parquet_file.schema_arrow.names if c in REQUIRED_COLUMNS | DAILY_COLUMNS]
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield _text_sites(pa, batch).to_pandas()
+    elif fmt == "arrow":
+        pa = _import_pyarrow()
+        for batch in _arrow_batches(pa, source):
+            batch = _text_sites(pa, batch)
+            for offset in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(offset, chunk_rows).to_pandas()
+    else:
+        raise UploadError(f"Unsupported file format: {fmt}")
+
+
+def fold_checked(fold, frames, report):
+    # Checks every chunk and folds its clean rows with fold(frame), which
+    # returns the rows repeating an earlier key; everything else goes to report
+    offset = 0
+    for df in frames:
+        daily = validate_frame(df)
+        with stage("Ingest: validate rows", len(df)):
+            frame, reasons = (check_daily_frame if daily else check_frame)(df)
+        with stage("Ingest: fold into store", len(frame)):
+            repeated = fold(frame)
+        reasons[np.flatnonzero(reasons < 0)[repeated]] = REASON_CODES["repeated_day" if daily else "repeated_month"]
+        report.add(df, offset, reasons)
+        offset += len(df)
+
+
+def read_store(source, fmt="csv", chunk_rows=CHUNK_ROWS):
+    # Monthly rows, or daily rows summed to monthly totals. Rows that fail the
+    # row checks are quarantined in store.validation; a file with no valid
+    # rows at all is rejected.
+    frames = timed_iter("Ingest: read chunk", iter_frames(source, fmt, chunk_rows))
+    first = next(frames, None)
+    builder = DailySalesBuilder() if first is not None and validate_frame(first) else SalesStoreBuilder()
+    report = ValidationReport()
+    if first is not None:
+        fold_checked(lambda frame: builder.fold(frame)[2], chain([first], frames), report)
+    if report.rows and report.quarantined == report.rows:
+        raise UploadError(f"No valid rows found ({report.describe()})")
+    store = builder.build()
+    store.validation = report
+    return store
+
+
+def parse_upload(data, fmt="csv"):
+    store = read_store(BytesIO(data), fmt)
+    # Build the per-site statistics index now so tab renders only look it up
+    with stage("Ingest: stats index", len(store)):
+        store.stats
+    return store
+
+
+def merge_upload(store, data, name=None):
+    # Folds a delta file into store in place and returns the periods it
+    # touched and the ValidationReport of its rows. Every chunk is checked for
+    # the required columns before anything is merged, and the delta is merged
+    # as one frame so a key repeated across chunks is still caught.
+    # Daily rows add to the stored months; days already loaded are
+    # quarantined as repeats.
+    frames = list(timed_iter("Ingest: read chunk", iter_frames(BytesIO(data), detect_format(name, data[:8]))))
+    for df in frames:
+        validate_frame(df)
+    report = ValidationReport()
+    touched = []
+
+    def fold(frame):
+        periods, repeated = store.merge(frame)
+        touched.append(periods)
+        return repeated
+
+    if frames:
+        fold_checked(fold, [pd.concat(frames, ignore_index=True)], report)
+    with stage("Ingest: stats index", len(store)):
+        store.stats
+    return (np.unique(np.concatenate(touched)) if touched else np.zeros(0, dtype=np.int32)), report
+
+
+def merged_key(dataset_key, delta_key):
+    return content_hash(f"{dataset_key}:{delta_key}".encode())
+
+
+def load_dataset(data, name=None):
+    # Returns a registry handle. Every session uploading the same file shares
+    # one parsed store, which is only parsed when no session holds it.
+    fmt = detect_format(name, data[:8])
+    return registry.acquire(content_hash(data), lambda: parse_upload(data, fmt))
@@ -0,0 +1,81 @@
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .calculation import STAGES, fingerprint, result_cache, run_stage
+
+# Shared by all sessions. The stages spend their time in NumPy, which
+# releases the GIL, so threads keep the Streamlit script responsive.
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="fuel-targets")
+
+
+class CalculationJob:
+    # Runs the calculation stages for one set of parameters in the background.
+    # outputs holds (stage name, frames) for every finished stage, so callers
+    # can show early stages while later ones run. cancel() stops the job
+    # before its next stage. known holds frames already calculated for calc
+    # (e.g. a target sheet refreshed after a merge) that the stages reuse.
+    # The job holds its own reference on the dataset while it runs, so a
+    # session detaching the dataset to merge into it gets a copy.
+
+    def __init__(self, dataset, calc, known=None):
+        self.calc = calc
+        self.key = fingerprint(calc)
+        self.known = dict(known or {})
+        self.outputs = []
+        self.result = {}
+        self._cancel = threading.Event()
+        self._future = None
+        cached = result_cache.get(self.key)
+        if cached is not None:
+            self.result = cached
+            self.outputs = [("Cached", cached)]
+        else:
+            # Run in a copy of the caller's context so its profiler sees the stages
+            self._future = executor.submit(contextvars.copy_context().run, self._run, dataset.share())
+
+    def _run(self, handle):
+        try:
+            store = handle.store
+            result = dict(self.known)
+            for stage in STAGES:
+                if self._cancel.is_set():
+                    return
+                frames = run_stage(stage, store, self.calc, result)
+                result = {**result, **frames}
+                self.result = result
+                self.outputs.append((stage[0], frames))
+            result_cache.put(self.key, result)
+        finally:
+            handle.release()
+
+    @property
+    def running(self):
+        return self._future is not None and not self._future.done()
+
+    @property
+    def cancelled(self):
+        return self._future is not None and self._cancel.is_set() and len(self.outputs) < len(STAGES)
+
+    @property
+    def error(self):
+        if self._future is None or not self._future.done():
+            return None
+        return self._future.exception()
+
+    @property
+    def progress(self):
+        return 1.0 if self._future is None else len(self.outputs) / len(STAGES)
+
+    @property
+    def next_stage(self):
+        done = len(self.outputs)
+        return STAGES[done][0] if self.running and done < len(STAGES) else None
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        if self._future is not None:
+            self._future.result(timeout)
+        return self.result
@@ -0,0 +1,49 @@
+import numpy as np
+
+# Periods are calendar months counted from January 1970, stored as int32.
+# Windows, horizons and lags become integer ranges instead of month-name scans.
+EPOCH_YEAR = 1970
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+MONTH_INDEX = {month: i for i, month in enumerate(MONTHS)}
+_MONTH_NAMES = np.array(MONTHS, dtype=object)
+
+
+def to_period(year, month):
+    # month is a name ("Jan") or a 0-based index; both arguments may be arrays
+    if isinstance(month, str):
+        month = MONTH_INDEX[month]
+    period = (np.asarray(year, dtype=np.int64) - EPOCH_YEAR) * 12 + np.asarray(month, dtype=np.int64)
+    return period.astype(np.int32) if period.ndim else int(period)
+
+
+def period_year(period):
+    return EPOCH_YEAR + np.asarray(period) // 12
+
+
+def period_month(period):
+    return _MONTH_NAMES[np.asarray(period) % 12]
+
+
+def split_period(period):
+    # (month name, year) of a scalar period
+    year, month = divmod(int(period), 12)
+    return MONTHS[month], EPOCH_YEAR + year
+
+
+def period_labels(periods):
+    return [f"{month} {year}" for month, year in map(split_period, np.asarray(periods).ravel())]
+
+
+def trailing(period, n):
+    # The n periods ending at (and including) period, oldest first
+    return np.arange(period - n + 1, period + 1, dtype=np.int32)
+
+
+def horizon(period, n):
+    # The n periods after period
+    return np.arange(period + 1, period + n + 1, dtype=np.int32)
+
+
+def lag(period, k=1):
+    return period - k
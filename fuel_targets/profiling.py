@@ -0,0 +1,204 @@
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Profiler of the code running in this context, if any. Library code marks
+# its stages with stage(), which costs one lookup when profiling is off.
+_current = contextvars.ContextVar("fuel_targets_profiler", default=None)
+
+# tracemalloc is process-wide; it runs while any profiler tracks memory.
+# Its peak is shared too, so it is folded into the open stages of every
+# profiler before it is reset. Reentrant, as a dropped profiler's finalizer
+# may stop tracing from a garbage collection inside a locked section.
+_tracing_lock = threading.RLock()
+_tracing_users = 0
+_open_frames = []
+
+STAGE_COLUMNS = ["Calls", "Items", "Total (s)", "Mean (ms)", "Max (ms)", "Last (ms)", "Peak Memory (MB)"]
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _fold_peak():
+    # Moves the peak so far into every open stage before it is reset.
+    # Called with _tracing_lock held.
+    peak = tracemalloc.get_traced_memory()[1]
+    for frame in _open_frames:
+        frame["peak"] = max(frame["peak"], peak)
+    tracemalloc.reset_peak()
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users = max(_tracing_users - 1, 0)
+        if _tracing_users == 0 and tracemalloc.is_tracing():
+            _fold_peak()
+            tracemalloc.stop()
+
+
+class StageProfiler:
+    # Wall time, call and item counts and (optionally) peak traced memory
+    # per named stage. Peaks are above the memory in use when the stage
+    # started; tracemalloc is process-wide, so a stage that overlaps another
+    # thread's stage (of any profiler) also counts that stage's allocations.
+
+    def __init__(self, track_memory=False):
+        self.track_memory = False
+        self.records = {}
+        self._lock = threading.Lock()
+        self._tracing = None
+        self.set_track_memory(track_memory)
+
+    def set_track_memory(self, enabled):
+        # A profiler that is dropped while tracking stops its share of tracing
+        if enabled and self._tracing is None:
+            _start_tracing()
+            self._tracing = weakref.finalize(self, _stop_tracing)
+        elif not enabled and self._tracing is not None:
+            self._tracing()
+            self._tracing = None
+        self.track_memory = bool(enabled)
+
+    def close(self):
+        self.set_track_memory(False)
+
+    @contextmanager
+    def stage(self, name, items=None):
+        frame = None
+        if self.track_memory:
+            with _tracing_lock:
+                if tracemalloc.is_tracing():
+                    _fold_peak()
+                    frame = {"start": tracemalloc.get_traced_memory()[0], "peak": 0}
+                    _open_frames.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if frame is not None:
+                with _tracing_lock:
+                    if tracemalloc.is_tracing():
+                        _fold_peak()
+                    _open_frames.remove(frame)
+                peak = frame["peak"] - frame["start"]
+            with self._lock:
+                self._record(name, seconds, items, peak)
+
+    def _record(self, name, seconds, items, peak):
+        record = self.records.setdefault(name, {"calls": 0, "items": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                "last_seconds": 0.0, "peak_bytes": None})
+        record["calls"] += 1
+        record["items"] += items or 0
+        record["seconds"] += seconds
+        record["max_seconds"] = max(record["max_seconds"], seconds)
+        record["last_seconds"] = seconds
+        if peak is not None:
+            record["peak_bytes"] = max(record["peak_bytes"] or 0, peak)
+
+    def reset(self):
+        with self._lock:
+            self.records = {}
+
+    def frame(self):
+        # One row per stage in first-run order
+        with self._lock:
+            records = {name: dict(record) for name, record in self.records.items()}
+        rows = [[r["calls"], r["items"], r["seconds"], r["seconds"] / r["calls"] * 1000, r["max_seconds"] * 1000,
+                 r["last_seconds"] * 1000, None if r["peak_bytes"] is None else r["peak_bytes"] / 2**20]
+                for r in records.values()]
+        return pd.DataFrame(rows, index=pd.Index(list(records), name="Stage"), columns=STAGE_COLUMNS)
+
+
+def set_profiler(profiler):
+    # Makes profiler (None to switch off) the one stage() records into for
+    # the rest of this context, e.g. one script run
+    _current.set(profiler)
+
+
+@contextmanager
+def profiling(profiler):
+    # set_profiler for the with block only
+    token = _current.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name, items=None):
+    profiler = _current.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name, items):
+        yield
+
+
+def timed_iter(name, iterable):
+    # Yields from iterable, recording each next() as a call of stage name
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def cache_stats():
+    # Hit rates of the process-wide caches, one row per cache
+    from .calculation import result_cache
+    from .charts import figure_cache
+    from .holidays import calendar_cache
+    from .registry import registry
+
+    caches = {
+        "Chart images": figure_cache.stats(),
+        "Calculation results": result_cache.stats(),
+        "Holiday calendars": calendar_cache.stats(),
+        "Datasets": registry.stats()
+    }
+    rows = {name: {key: stats.get(key) for key in ("size", "hits", "misses", "hit_rate")}
+            for name, stats in caches.items()}
+    rows["Datasets"]["size"] = caches["Datasets"]["active"] + caches["Datasets"]["idle"]
+    return pd.DataFrame.from_dict(rows, orient="index").rename_axis("Cache")
+
+
+def _records(df):
+    # Rows as dicts with missing values as None, which JSON can represent
+    df = df.reset_index()
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def profile_json(profiler, caches=None):
+    caches = cache_stats() if caches is None else caches
+    return json.dumps({
+        "stages": _records(profiler.frame()),
+        "caches": _records(caches),
+        "memory_tracked": profiler.track_memory
+    }, indent=2, default=float)
+
+
+def profile_csv(profiler, caches=None):
+    # Stages and caches in one CSV, told apart by the Section column
+    caches = cache_stats() if caches is None else caches
+    stages = profiler.frame().reset_index().rename(columns={"Stage": "Name"})
+    caches = caches.reset_index().rename(columns={"Cache": "Name"})
+    return pd.concat([stages.assign(Section="stage"), caches.assign(Section="cache")],
+                     ignore_index=True).to_csv(index=False)
@@ -0,0 +1,199 @@
+import os
+import threading
+import weakref
+
+import numpy as np
+
+from .cache import LRUCache
+
+SPILLED_ARRAYS = ("values", "mask", "yoy", "mom")
+
+
+class DatasetRegistry:
+    # Process-wide store of parsed datasets keyed by content hash. Sessions
+    # hold a DatasetHandle instead of their own copy; a dataset nobody holds
+    # stays in an idle LRU for quick reuse. With spill_dir set, the large
+    # arrays live in memory-mapped .npy files shared through the page cache.
+
+    def __init__(self, spill_dir=None, max_idle=8):
+        self.spill_dir = spill_dir
+        self._active = {}
+        self._refs = {}
+        self._idle = LRUCache(maxsize=max_idle)
+        self._lock = threading.RLock()
+        # Keys being built by acquire(), each with an event set when it ends
+        self._building = {}
+        # acquire() calls that reused a parsed dataset and that had to build one
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._active or key in self._idle
+
+    def _take(self, key):
+        store = self._active.get(key)
+        if store is None:
+            store = self._idle.pop(key)
+        return store
+
+    def _build(self, key, factory):
+        store = factory()
+        store.stats
+        if self.spill_dir:
+            self._spill(key, store)
+        return store
+
+    def _register(self, key, store):
+        self._active[key] = store
+        self._refs[key] = self._refs.get(key, 0) + 1
+        return DatasetHandle(self, key)
+
+    def acquire(self, key, factory):
+        # Returns a handle on key's dataset, building it with factory() if it
+        # is neither active nor idle. The build runs outside the lock so other
+        # datasets stay available; concurrent acquirers of the same key wait
+        # for it instead of building their own.
+        return self._acquire(key, factory, counted=True)
+
+    def _acquire(self, key, factory, counted):
+        # counted: whether the call counts towards hits and misses
+        while True:
+            with self._lock:
+                store = self._take(key)
+                if store is not None:
+                    self.hits += counted
+                    return self._register(key, store)
+                building = self._building.get(key)
+                if building is None:
+                    building = self._building[key] = threading.Event()
+                    break
+            # Take the built store, or build it here if that build failed
+            building.wait()
+
+        try:
+            store = self._build(key, factory)
+        except BaseException:
+            with self._lock:
+                del self._building[key]
+            building.set()
+            raise
+        with self._lock:
+            del self._building[key]
+            self.misses += counted
+            handle = self._register(key, store)
+        building.set()
+        return handle
+
+    def retain(self, key):
+        # Another handle on an active dataset
+        with self._lock:
+            return self._register(key, self._active[key])
+
+    def get(self, key):
+        with self._lock:
+            return self._active.get(key)
+
+    def refs(self, key):
+        return self._refs.get(key, 0)
+
+    def release(self, key):
+        with self._lock:
+            if key not in self._refs:
+                return
+            self._refs[key] -= 1
+            if self._refs[key] > 0:
+                return
+            del self._refs[key]
+            before = set(self._idle._data)
+            self._idle.put(key, self._active.pop(key))
+            evicted = before - set(self._idle._data)
+        for evicted_key in evicted:
+            self._remove_spill(evicted_key)
+
+    def detach(self, handle):
+        # Gives the caller a private, writable store for the handle's data and
+        # drops the handle's reference. The shared store is handed over as-is
+        # when nobody else holds it, otherwise it is copied.
+        with self._lock:
+            key = handle.key
+            store = self._active[key]
+            exclusive = self._refs[key] == 1 and store.values.flags.writeable
+            if exclusive:
+                del self._active[key], self._refs[key]
+            handle._forget()
+        if exclusive:
+            self._remove_spill(key)
+            return store
+        self.release(key)
+        return store.copy()
+
+    def publish(self, key, store):
+        # Registers a privately built store under key and returns a handle.
+        # If another session already published the same key, that one is used.
+        # Not a cache lookup, so hits and misses are left alone.
+        return self._acquire(key, lambda: store, counted=False)
+
+    def _paths(self, key):
+        return {name: os.path.join(self.spill_dir, f"{key}.{name}.npy") for name in SPILLED_ARRAYS}
+
+    def _spill(self, key, store):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        paths = self._paths(key)
+        targets = {"values": store, "mask": store, "yoy": store.stats, "mom": store.stats}
+        for name, path in paths.items():
+            np.save(path, getattr(targets[name], name))
+            setattr(targets[name], name, np.load(path, mmap_mode="r"))
+
+    def _remove_spill(self, key):
+        if not self.spill_dir:
+            return
+        for path in self._paths(key).values():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            stores = list(self._active.values()) + list(self._idle._data.values())
+            return {
+                "active": len(self._active),
+                "idle": len(self._idle),
+                "handles": sum(self._refs.values()),
+                "bytes": sum(store.memory_usage()["total"] for store in stores),
+                "memory_mapped": bool(self.spill_dir),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+            }
+
+
+class DatasetHandle:
+    # A session's reference to a registered dataset. The reference is
+    # released explicitly or when the handle is garbage collected with the
+    # session state.
+
+    def __init__(self, registry, key):
+        self.registry = registry
+        self.key = key
+        self._finalizer = weakref.finalize(self, registry.release, key)
+
+    @property
+    def store(self):
+        return self.registry.get(self.key)
+
+    def release(self):
+        self._finalizer()
+
+    def _forget(self):
+        self._finalizer.detach()
+
+    def share(self):
+        # A second reference to the same dataset, released independently
+        return self.registry.retain(self.key)
+
+    def detach(self):
+        return self.registry.detach(self)
+
+
+registry = DatasetRegistry(spill_dir=os.environ.get("FUEL_TARGETS_DATA_DIR"))
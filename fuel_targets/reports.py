@@ -0,0 +1,132 @@
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from .engine import TARGET_COLUMNS
+from .periods import lag, split_period, to_period
+
+
+def yoy_growth(store, site, month, year):
+    growth = store.yoy_growth(site, year, month)
+    if growth is not None:
+        return growth
+    current_sales = store.get(site, year, month, 0)
+    prev_year_sales = store.get(site, year-1, month, 0)
+    return ((current_sales - prev_year_sales)/prev_year_sales)*100 if prev_year_sales !=0 else 0
+
+
+def mom_growth(store, site, month, year):
+    growth = store.mom_growth(site, year, month)
+    if growth is not None:
+        return growth
+    prev_month, prev_year = split_period(lag(to_period(year, month)))
+    current_sales = store.get(site, year, month, 0)
+    prev_sales = store.get(site, prev_year, prev_month, 0)
+    return ((current_sales - prev_sales)/prev_sales)*100 if prev_sales !=0 else 0
+
+
+def historical_sales(store, site, month, base_years):
+    sales, mask = store.month_lookup(store.rows([site]), month, base_years)
+    return pd.DataFrame({
+        "Year": [year for year, ok in zip(base_years, mask[0]) if ok],
+        "Sales": sales[0][mask[0]]
+    })
+
+
+def site_report(store, results_df, site, month, year, base_years):
+    # Report for one site as offered for download on the Site Report tab.
+    # Sites without a target row (Combined mode, or no base-year data) report
+    # no variance and empty target details.
+    current_sales = store.get(site, year, month, 0)
+    target_details = results_df.loc[site].to_dict() if site in results_df.index else {}
+    target = target_details.get("Base Target", 0)
+    variance = (current_sales - target)/target * 100 if target !=0 else 0
+    return {
+        "KPIs": {
+            "Current Month Sales": current_sales,
+            "YoY Growth": f"{yoy_growth(store, site, month, year):.1f}%",
+            "MoM Growth": f"{mom_growth(store, site, month, year):.1f}%",
+            "Variance from Target": f"{variance:.1f}%"
+        },
+        "Historical Sales": historical_sales(store, site, month, base_years).to_dict('records'),
+        "Target Details": target_details
+    }
+
+
+def convert_types(obj):
+    if isinstance(obj, (np.integer, np.floating)):
+        return int(obj) if isinstance(obj, np.integer) else float(obj)
+    return obj
+
+
+def report_json(report):
+    return json.dumps(report, default=convert_types, indent=4)
+
+
+def _growth_column(store, rows, period, k, matrix):
+    # Vectorised store.yoy_growth / mom_growth with the formula fallback of
+    # yoy_growth / mom_growth for periods outside the stored range
+    col = store.column(period)
+    if 0 <= col < store.n_periods:
+        return matrix[rows, col].astype(np.float64)
+    values, _ = store.lookup(rows, [period, period - k])
+    current, previous = values[:, 0], values[:, 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(previous != 0, (current - previous)/previous*100, 0.0)
+
+
+def report_summary(store, results_df, sites, month, year, base_years):
+    # Every figure of site_report for all sites at once, one row per site.
+    # Missing sales and targets are NaN.
+    rows = store.rows(sites)
+    period = to_period(year, month)
+    values, mask = store.lookup(rows, [period])
+    current = np.where(mask[:, 0], values[:, 0], np.nan)
+    targets = results_df.reindex(list(sites))[TARGET_COLUMNS].astype(np.float64)
+    base = targets["Base Target"].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = np.where((base != 0) & ~np.isnan(base), (np.nan_to_num(current) - base)/base*100, 0.0)
+    sales, sales_mask = store.month_lookup(rows, month, base_years)
+    summary = pd.DataFrame({
+        "Current Month Sales": current,
+        "YoY Growth %": _growth_column(store, rows, period, 12, store.stats.yoy),
+        "MoM Growth %": _growth_column(store, rows, period, 1, store.stats.mom),
+        "Variance from Target %": variance
+    }, index=pd.Index(list(sites), name="Site"))
+    summary[TARGET_COLUMNS] = targets.to_numpy()
+    for i, base_year in enumerate(base_years):
+        summary[f"Sales {base_year}"] = np.where(sales_mask[:, i], sales[:, i], np.nan)
+    return summary
+
+
+def _summary_reports(summary, month, year, base_years):
+    # site_report documents rebuilt from summary rows, as (file name, JSON bytes)
+    documents = []
+    for site, row in zip(summary.index, summary.to_dict("records")):
+        current = row["Current Month Sales"]
+        report = {
+            "KPIs": {
+                "Current Month Sales": 0 if np.isnan(current) else current,
+                "YoY Growth": f"{row['YoY Growth %']:.1f}%",
+                "MoM Growth": f"{row['MoM Growth %']:.1f}%",
+                "Variance from Target": f"{row['Variance from Target %']:.1f}%"
+            },
+            "Historical Sales": [{"Year": y, "Sales": row[f"Sales {y}"]} for y in base_years
+                                 if not np.isnan(row[f"Sales {y}"])],
+            "Target Details": {} if np.isnan(row["Base Target"]) else
+            {column: int(row[column]) for column in TARGET_COLUMNS}
+        }
+        documents.append((f"{site}_report_{month}_{year}.json", report_json(report).encode()))
+    return documents
+
+
+def write_report_zip(target, summary, month, year, base_years, chunk_size=500):
+    # Writes one JSON site report per summary row into a ZIP at target (a
+    # path or binary file), serialising chunk_size reports at a time
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for i in range(0, len(summary), chunk_size):
+            for name, data in _summary_reports(summary.iloc[i:i + chunk_size], month, year, base_years):
+                archive.writestr(name, data)
+    return len(summary)
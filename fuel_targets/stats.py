@@ -0,0 +1,87 @@
+import numpy as np
+
+# Growth percentages are only shown to one decimal, so the two
+# site x period growth matrices are kept in single precision
+GROWTH_DTYPE = np.float32
+
+
+def growth_matrix(values, lag):
+    # Percentage growth of every period over the period `lag` months earlier.
+    # As in the per-site helpers, a zero (or missing) earlier value gives 0.
+    previous = np.zeros_like(values)
+    previous[:, lag:] = values[:, :-lag]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        growth = (values - previous) / previous * 100
+    return np.where(previous != 0, growth, 0.0)
+
+
+def _filled(values, mask, rows, cols):
+    cells = values[rows, cols].astype(np.float64)
+    return np.where(mask[rows, cols] & ~np.isnan(cells), cells, 0.0)
+
+
+def growth_cells(values, mask, rows, cols, lag):
+    # growth_matrix for individual (row, col) cells only
+    current = _filled(values, mask, rows, cols)
+    has_previous = cols >= lag
+    previous = np.where(has_previous, _filled(values, mask, rows, np.where(has_previous, cols - lag, 0)), 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        growth = (current - previous) / previous * 100
+    return np.where(previous != 0, growth, 0.0)
+
+
+class SiteStats:
+    # Per-dataset index built once from a store's values and mask: each
+    # site's peak period, and YoY / MoM growth for every site and period.
+
+    def __init__(self, values, mask):
+        observed = mask & ~np.isnan(values)
+        filled = np.where(observed, values.astype(np.float64), 0.0)
+        self.yoy = growth_matrix(filled, 12).astype(GROWTH_DTYPE)
+        self.mom = growth_matrix(filled, 1).astype(GROWTH_DTYPE)
+
+        n_sites, n_periods = values.shape
+        if n_periods:
+            masked = np.where(observed, values, -np.inf)
+            self.peak_period = masked.argmax(axis=1)
+            self.peak_sales = masked[np.arange(n_sites), self.peak_period]
+        else:
+            self.peak_period = np.zeros(n_sites, dtype=np.int64)
+            self.peak_sales = np.full(n_sites, -np.inf)
+
+    def copy(self):
+        stats = SiteStats.__new__(SiteStats)
+        stats.yoy, stats.mom = self.yoy.copy(), self.mom.copy()
+        stats.peak_period, stats.peak_sales = self.peak_period.copy(), self.peak_sales.copy()
+        return stats
+
+    def _recompute_peaks(self, values, mask, rows):
+        observed = mask[rows] & ~np.isnan(values[rows])
+        masked = np.where(observed, values[rows], -np.inf)
+        self.peak_period[rows] = masked.argmax(axis=1)
+        self.peak_sales[rows] = masked[np.arange(len(rows)), self.peak_period[rows]]
+
+    def refresh(self, values, mask, rows, cols):
+        # Updates the index after the (rows, cols) cells changed in place. Only
+        # those cells and the cells that lag them are recomputed.
+        n_periods = values.shape[1]
+        for matrix, lag in ((self.yoy, 12), (self.mom, 1)):
+            r = np.concatenate([rows, rows])
+            c = np.concatenate([cols, cols + lag])
+            inside = c < n_periods
+            matrix[r[inside], c[inside]] = growth_cells(values, mask, r[inside], c[inside], lag)
+
+        # A row whose peak cell was overwritten may have lost its peak: rescan
+        # it. Elsewhere the peak can only move to one of the new cells.
+        rescan = np.unique(rows[cols == self.peak_period[rows]])
+        cells = values[rows, cols]
+        new = np.where(mask[rows, cols] & ~np.isnan(cells), cells, -np.inf)
+        order = np.lexsort((new, rows))
+        sorted_rows = rows[order]
+        last = np.r_[sorted_rows[1:] != sorted_rows[:-1], True] if len(order) else np.zeros(0, dtype=bool)
+        best_rows, best_cols, best_sales = sorted_rows[last], cols[order][last], new[order][last]
+        better = best_sales > self.peak_sales[best_rows]
+        self.peak_period[best_rows[better]] = best_cols[better]
+        self.peak_sales[best_rows[better]] = best_sales[better]
+        if rescan.size:
+            self._recompute_peaks(values, mask, rescan)
@@ -0,0 +1,390 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from .periods import MONTH_INDEX, MONTHS, period_year, split_period, to_period
+from .stats import SiteStats
+
+# Sales are kept as float32 while every value is exactly representable (whole
+# rands up to 16.7 million); the first value that is not switches the store to
+# float64. Reads are returned as float64 so sums never lose precision.
+COMPACT_DTYPE = np.float32
+# Day bits of a month loaded as a whole from monthly rows
+FULL_MONTH = np.uint32(0xFFFFFFFF)
+
+
+class SalesStore:
+    # Dense site x period store. Row i holds the sales of sites[i]; column c
+    # holds period start_period + c, where start_period is January of
+    # start_year (see periods). Cells that were not present in the upload are
+    # False in mask.
+
+    def __init__(self, sites, start_year, values, mask):
+        self.sites = list(sites)
+        self.site_index = {site: i for i, site in enumerate(self.sites)}
+        self.start_year = int(start_year)
+        self.start_period = to_period(self.start_year, 0)
+        self.values = values
+        self.mask = mask
+        # Bit per day loaded of each site-month, for stores that daily rows
+        # were folded into (see DailySalesBuilder); None otherwise
+        self.days = None
+        # ValidationReport of the rows quarantined when the store was read
+        self.validation = None
+        self._stats = None
+
+    @classmethod
+    def from_frame(cls, df):
+        return SalesStoreBuilder().add(df).build()
+
+    def to_frame(self):
+        # Stored cells as rows in the upload schema
+        rows, cols = np.nonzero(self.mask)
+        periods = cols + self.start_period
+        return pd.DataFrame({
+            "Year": period_year(periods).astype(np.int16),
+            "Month": pd.Categorical.from_codes(periods % 12, MONTHS),
+            "Sales": self.values[rows, cols].astype(np.float64),
+            "Site": pd.Categorical.from_codes(rows, self.sites)
+        })
+
+    def copy(self):
+        store = SalesStore(self.sites, self.start_year, self.values.copy(), self.mask.copy())
+        store.days = None if self.days is None else self.days.copy()
+        store.validation = self.validation
+        if self._stats is not None:
+            store._stats = self._stats.copy()
+        return store
+
+    def merge(self, df):
+        # Folds delta rows into this store in place and returns the periods
+        # they touched, plus the delta rows that repeat an earlier row's site
+        # and month. Unless the delta brings new sites or years, only its own
+        # cells are written and the stats index is refreshed around them.
+        # Monthly rows (Year, Month) replace the stored month; daily rows
+        # (Period, Day) add to it, and days already loaded count as repeats.
+        daily = "Day" in df.columns
+        builder = (DailySalesBuilder if daily or self.days is not None else SalesStoreBuilder).from_store(self)
+        shape, dtype = self.values.shape, self.values.dtype
+        rows, cols, repeated = builder.fold(df)
+        merged = builder.build()
+        self.sites, self.site_index = merged.sites, merged.site_index
+        self.start_year, self.start_period = merged.start_year, merged.start_period
+        self.values, self.mask, self.days = merged.values, merged.mask, merged.days
+        if self.values.shape != shape or self.values.dtype != dtype:
+            self._stats = None
+        elif self._stats is not None:
+            self._stats.refresh(self.values, self.mask, rows, cols)
+        return np.unique(cols + self.start_period).astype(np.int32), repeated
+
+    @property
+    def stats(self):
+        # Built on first use (ingestion builds it at load time) and kept for
+        # the life of the store
+        if self._stats is None:
+            self._stats = SiteStats(self.values, self.mask)
+        return self._stats
+
+    @property
+    def n_periods(self):
+        return self.values.shape[1]
+
+    @property
+    def years(self):
+        return list(range(self.start_year, self.start_year + self.n_periods // 12))
+
+    def __len__(self):
+        return len(self.sites)
+
+    @property
+    def periods(self):
+        return np.arange(self.start_period, self.start_period + self.n_periods, dtype=np.int32)
+
+    def latest_period(self):
+        # Most recent period with any data, or None
+        observed = np.flatnonzero(self.mask.any(axis=0))
+        return int(self.start_period + observed[-1]) if observed.size else None
+
+    def latest(self):
+        period = self.latest_period()
+        return None if period is None else split_period(period)
+
+    def column(self, period):
+        return period - self.start_period
+
+    def rows(self, sites):
+        return np.array([self.site_index[site] for site in sites], dtype=np.int64)
+
+    def subset(self, rows):
+        return SalesStore([self.sites[i] for i in rows], self.start_year,
+                          self.values[rows], self.mask[rows])
+
+    def lookup(self, rows, periods):
+        # Values and mask for rows x arbitrary periods. Periods outside the
+        # stored range are reported as missing; missing cells read as 0.
+        cols = self.column(np.asarray(periods, dtype=np.int64))
+        inside = (cols >= 0) & (cols < self.n_periods)
+        if self.n_periods == 0:
+            shape = (len(rows), len(cols))
+            return np.zeros(shape), np.zeros(shape, dtype=bool)
+        cols = np.where(inside, cols, 0)
+        mask = self.mask[np.ix_(rows, cols)] & inside
+        values = np.where(mask, self.values[np.ix_(rows, cols)].astype(np.float64), 0.0)
+        return values, mask
+
+    def window(self, rows, first_period, n):
+        # Values and mask for n consecutive periods from first_period, taken
+        # as one column slice; rows=None means every site.
+        rows = slice(None) if rows is None else rows
+        n_rows = len(self.sites) if isinstance(rows, slice) else len(rows)
+        values = np.zeros((n_rows, n))
+        mask = np.zeros((n_rows, n), dtype=bool)
+        start = self.column(first_period)
+        lo, hi = max(start, 0), min(start + n, self.n_periods)
+        if lo < hi:
+            mask[:, lo - start:hi - start] = self.mask[rows, lo:hi]
+            values[:, lo - start:hi - start] = np.where(mask[:, lo - start:hi - start],
+                                                        self.values[rows, lo:hi], 0.0)
+        return values, mask
+
+    def trailing(self, rows, last_period, n):
+        # The n periods ending at last_period, oldest first
+        return self.window(rows, last_period - n + 1, n)
+
+    def month_lookup(self, rows, month, years):
+        return self.lookup(rows, to_period(np.asarray(years), month))
+
+    def has(self, site, year, month):
+        if site not in self.site_index:
+            return False
+        col = self.column(to_period(year, month))
+        return 0 <= col < self.n_periods and bool(self.mask[self.site_index[site], col])
+
+    def get(self, site, year, month, default=0):
+        if not self.has(site, year, month):
+            return default
+        return float(self.values[self.site_index[site], self.column(to_period(year, month))])
+
+    def _growth(self, matrix, site, year, month):
+        row, col = self.site_index[site], self.column(to_period(year, month))
+        if 0 <= col < self.n_periods:
+            return float(matrix[row, col])
+        return None
+
+    def yoy_growth(self, site, year, month):
+        # Percent change on the same month a year earlier; None outside the
+        # stored period range
+        return self._growth(self.stats.yoy, site, year, month)
+
+    def mom_growth(self, site, year, month):
+        return self._growth(self.stats.mom, site, year, month)
+
+    def memory_usage(self):
+        # Bytes held by the dataset: sales and mask arrays (with the day bits
+        # of daily data), the statistics index (when built) and the site name
+        # index
+        stats = self._stats
+        index = sys.getsizeof(self.sites) + sys.getsizeof(self.site_index) + \
+            sum(sys.getsizeof(site) for site in self.sites)
+        usage = {
+            "sales": self.values.nbytes,
+            "mask": self.mask.nbytes + (0 if self.days is None else self.days.nbytes),
+            "stats": 0 if stats is None else sum(a.nbytes for a in (stats.yoy, stats.mom, stats.peak_period,
+                                                                    stats.peak_sales)),
+            "sites": index
+        }
+        usage["total"] = sum(usage.values())
+        return usage
+
+
+class SalesStoreBuilder:
+    # Folds row chunks into a growing dense store so large files never have to
+    # be held as one DataFrame. Site rows grow geometrically; the period axis
+    # is widened whenever a chunk brings years outside the current range.
+    # written marks the cells folded by this builder, so a repeated
+    # (site, period) key is caught in O(1) whichever chunk it arrives in.
+
+    # Arrays shaped (site capacity, periods) that _reserve grows together
+    ARRAYS = ("values", "mask", "written")
+
+    def __init__(self):
+        self.sites = []
+        self.site_index = {}
+        self.start_year = None
+        self.end_year = None
+        self.values = np.zeros((0, 0), dtype=COMPACT_DTYPE)
+        self.mask = np.zeros((0, 0), dtype=bool)
+        self.written = np.zeros((0, 0), dtype=bool)
+
+    @classmethod
+    def from_store(cls, store):
+        # Continues folding into an existing store's arrays (no copy)
+        builder = cls()
+        builder.sites = list(store.sites)
+        builder.site_index = dict(store.site_index)
+        builder.values, builder.mask = store.values, store.mask
+        builder.written = np.zeros(store.mask.shape, dtype=bool)
+        if store.n_periods:
+            builder.start_year = store.start_year
+            builder.end_year = store.start_year + store.n_periods // 12 - 1
+        return builder
+
+    def _site_codes(self, site_column):
+        # Factorizing first means only the distinct sites are turned into
+        # strings (and categorical columns are factorized from their codes)
+        codes, uniques = pd.factorize(site_column, use_na_sentinel=False)
+        lookup = np.empty(len(uniques), dtype=np.int64)
+        for i, site in enumerate(np.asarray(uniques).astype(str).tolist()):
+            if site not in self.site_index:
+                self.site_index[site] = len(self.sites)
+                self.sites.append(site)
+            lookup[i] = self.site_index[site]
+        return lookup[codes]
+
+    def _reserve(self, first_year, last_year):
+        n_sites = len(self.sites)
+        if self.start_year is None:
+            self.start_year, self.end_year = first_year, last_year
+            for name in self.ARRAYS:
+                setattr(self, name, np.zeros((n_sites, 0), dtype=getattr(self, name).dtype))
+        start = min(self.start_year, first_year)
+        end = max(self.end_year, last_year)
+        n_periods = (end - start + 1) * 12
+        capacity = self.values.shape[0]
+        if n_sites > capacity:
+            capacity = max(n_sites, 2 * capacity)
+        if (capacity, n_periods) == self.values.shape:
+            return
+        offset = (self.start_year - start) * 12
+        old_rows, old_periods = self.values.shape
+        for name in self.ARRAYS:
+            old = getattr(self, name)
+            grown = np.zeros((capacity, n_periods), dtype=old.dtype)
+            grown[:old_rows, offset:offset + old_periods] = old
+            setattr(self, name, grown)
+        self.start_year, self.end_year = start, end
+
+    def fold(self, df):
+        # Writes a chunk's rows and returns the (rows, cols) it wrote and a
+        # bool per row of df marking repeats: rows whose site and period were
+        # already written by this builder (or earlier in the chunk). Repeats
+        # are left out, so the first row for a key wins.
+        rows = self._site_codes(df["Site"])
+        month = df["Month"]
+        if isinstance(month.dtype, pd.CategoricalDtype) and list(month.cat.categories) == MONTHS:
+            month_codes = month.cat.codes.to_numpy(dtype=np.int64)
+        else:
+            month_codes = np.nan_to_num(month.map(MONTH_INDEX).to_numpy(dtype=float), nan=-1).astype(np.int64)
+        known = month_codes >= 0
+        years = df["Year"].to_numpy(dtype=np.int64)[known]
+        sales = df["Sales"].to_numpy(dtype=np.float64)[known]
+        repeated = np.zeros(len(df), dtype=bool)
+
+        if not known.any():
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), repeated
+        self._reserve(int(years.min()), int(years.max()))
+        rows = rows[known]
+        cols = to_period(years, month_codes[known]) - to_period(self.start_year, 0)
+        repeat = pd.Series(rows * self.values.shape[1] + cols).duplicated().to_numpy() | \
+            self.written[rows, cols]
+        repeated[np.flatnonzero(known)[repeat]] = True
+        rows, cols, sales = rows[~repeat], cols[~repeat], sales[~repeat]
+        if self.values.dtype != np.float64 and \
+                not np.array_equal(sales.astype(self.values.dtype), sales, equal_nan=True):
+            self.values = self.values.astype(np.float64)
+
+        self.values[rows, cols] = sales
+        self.mask[rows, cols] = True
+        self.written[rows, cols] = True
+        return rows, cols, repeated
+
+    def add(self, df):
+        self.fold(df)
+        return self
+
+    def build(self):
+        n_sites = len(self.sites)
+        if self.start_year is None:
+            return SalesStore(self.sites, 0, np.zeros((n_sites, 0), dtype=COMPACT_DTYPE),
+                              np.zeros((n_sites, 0), dtype=bool))
+        self._reserve(self.start_year, self.end_year)
+        values, mask = self.values, self.mask
+        if values.shape[0] != n_sites:
+            values, mask = values[:n_sites].copy(), mask[:n_sites].copy()
+        return SalesStore(self.sites, self.start_year, values, mask)
+
+
+class DailySalesBuilder(SalesStoreBuilder):
+    # Resamples daily rows (Site, Period, Day, Sales) to monthly totals while
+    # folding: one groupby per chunk sums each site-month, and the totals are
+    # added to the store. Sums stay in float64 until build(). days holds a bit
+    # per day of each site-month, so a repeated (site, date) is caught
+    # whichever chunk it arrives in; it is kept on the built store so later
+    # merges can add days to a month.
+
+    ARRAYS = SalesStoreBuilder.ARRAYS + ("days",)
+
+    def __init__(self):
+        super().__init__()
+        self.values = np.zeros((0, 0), dtype=np.float64)
+        self.days = np.zeros((0, 0), dtype=np.uint32)
+        self.compact = True
+
+    @classmethod
+    def from_store(cls, store):
+        # Months a monthly store holds count as fully loaded. The store keeps
+        # its dtype: merges do not compact it again.
+        builder = super().from_store(store)
+        builder.days = store.days if store.days is not None else \
+            np.where(store.mask, FULL_MONTH, np.uint32(0)).astype(np.uint32)
+        builder.compact = False
+        return builder
+
+    def fold(self, df):
+        # Same contract as SalesStoreBuilder.fold; repeats are rows whose site
+        # and date were already folded. Monthly rows replace their months.
+        if "Day" not in df.columns:
+            rows, cols, repeated = super().fold(df)
+            self.days[rows, cols] = FULL_MONTH
+            return rows, cols, repeated
+        rows = self._site_codes(df["Site"])
+        periods = df["Period"].to_numpy(dtype=np.int64)
+        repeated = np.zeros(len(df), dtype=bool)
+        if not len(df):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), repeated
+        years = period_year(periods)
+        self._reserve(int(years.min()), int(years.max()))
+        n_periods = self.values.shape[1]
+        cols = periods - to_period(self.start_year, 0)
+        days = df["Day"].to_numpy(dtype=np.int64)
+        bits = np.left_shift(np.uint32(1), (days - 1).astype(np.uint32))
+        cells = rows * n_periods + cols
+        repeated = pd.Series(cells * 32 + days).duplicated().to_numpy() | (self.days[rows, cols] & bits != 0)
+
+        keep = ~repeated
+        totals = pd.DataFrame({
+            "Sales": df["Sales"].to_numpy(dtype=np.float64)[keep],
+            "Days": bits[keep].astype(np.int64)
+        }).groupby(cells[keep]).sum()
+        rows, cols = np.divmod(totals.index.to_numpy(dtype=np.int64), n_periods)
+        sales = self.values[rows, cols].astype(np.float64) + totals["Sales"].to_numpy()
+        if self.values.dtype != np.float64 and \
+                not np.array_equal(sales.astype(self.values.dtype), sales, equal_nan=True):
+            self.values = self.values.astype(np.float64)
+        self.values[rows, cols] = sales
+        self.days[rows, cols] |= totals["Days"].to_numpy().astype(np.uint32)
+        self.mask[rows, cols] = True
+        self.written[rows, cols] = True
+        return rows, cols, repeated
+
+    def build(self):
+        store = super().build()
+        if self.compact:
+            compact = store.values.astype(COMPACT_DTYPE)
+            if np.array_equal(compact, store.values, equal_nan=True):
+                store.values = compact
+        n_sites = len(self.sites)
+        if self.start_year is not None:
+            store.days = self.days if self.days.shape[0] == n_sites else self.days[:n_sites].copy()
+        return store
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from .periods import MONTHS
+
+DEFAULT_YEARS = (2021, 2022, 2023, 2024, 2025)
+
+# Relative monthly volume of a typical forecourt: quiet Feb, busy Easter and
+# December holiday travel.
+SEASONALITY = np.array([0.97, 0.90, 1.00, 1.04, 0.98, 0.95,
+                        0.99, 1.00, 0.98, 1.01, 1.02, 1.16])
+
+
+def generate_sales(n_sites=100, years=DEFAULT_YEARS, missing_rate=0.05, seed=0):
+    # Synthetic monthly fuel sales in the upload schema (Year, Month, Sales,
+    # Site). Each site gets its own volume level and yearly trend; a
+    # missing_rate share of site-months is dropped at random.
+    rng = np.random.default_rng(seed)
+    years = np.asarray(list(years), dtype=np.int64)
+    n_periods = len(years) * 12
+    elapsed = np.arange(n_periods) / 12
+
+    level = rng.lognormal(mean=np.log(150_000), sigma=0.5, size=n_sites)
+    trend = (1 + rng.normal(0.03, 0.04, size=n_sites))[:, None] ** elapsed[None, :]
+    noise = rng.normal(1, 0.06, size=(n_sites, n_periods)).clip(0.5)
+    sales = np.round(level[:, None] * np.tile(SEASONALITY, len(years))[None, :] * trend * noise)
+
+    keep = rng.random((n_sites, n_periods)) >= missing_rate
+    site_idx, period_idx = np.nonzero(keep)
+    width = len(str(max(n_sites - 1, 0)))
+    sites = np.array([f"Site {i:0{width}d}" for i in range(n_sites)], dtype=object)
+    return pd.DataFrame({
+        "Year": years[period_idx // 12],
+        "Month": np.array(MONTHS, dtype=object)[period_idx % 12],
+        "Sales": sales[keep],
+        "Site": sites[site_idx]
+    })
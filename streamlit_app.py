@@ -1,158 +1,242 @@
 import streamlit as st
 import pandas as pd
-import math
 from datetime import datetime
-import matplotlib.pyplot as plt
 import numpy as np
-import json
-from io import StringIO
+import contextvars
+import time
+from io import BytesIO, StringIO
+
+from fuel_targets import charts, jobs
+from fuel_targets import (UPLOAD_TYPES, MONTHS, CalculationJob, StageProfiler, UploadError, cache_stats,
+                          calc_params, content_hash, load_dataset, merge_upload, merged_key, month_holidays,
+                          profile_csv, profile_json, refresh_target_sheet, registry, report_json,
+                          report_summary, scenario_sweep, set_profiler, site_report, stage, target_year,
+                          working_day_sales, write_report_zip)
 
 # Initialize session state variables
-if 'sales_data' not in st.session_state:
-    st.session_state.sales_data = {}
+# The session only holds a handle on the dataset; the store itself lives in
+# the process-wide registry and is shared by sessions with the same data.
+if 'dataset' not in st.session_state:
+    st.session_state.dataset = None
+if 'upload_key' not in st.session_state:
+    st.session_state.upload_key = None
+# file_id of the uploads last hashed, so reruns skip hashing the same bytes
+if 'upload_file_id' not in st.session_state:
+    st.session_state.upload_file_id = None
+if 'delta_file_id' not in st.session_state:
+    st.session_state.delta_file_id = None
+if 'applied_deltas' not in st.session_state:
+    st.session_state.applied_deltas = set()
 if 'available_sites' not in st.session_state:
     st.session_state.available_sites = []
 if 'results_df' not in st.session_state:
     st.session_state.results_df = pd.DataFrame()
 if 'top_month_df' not in st.session_state:
     st.session_state.top_month_df = pd.DataFrame()
-if 'last_six_df' not in st.session_state:
-    st.session_state.last_six_df = pd.DataFrame()
+if 'trend_df' not in st.session_state:
+    st.session_state.trend_df = pd.DataFrame()
 if 'future_proj' not in st.session_state:
     st.session_state.future_proj = pd.DataFrame()
+if 'avg_growth_rate' not in st.session_state:
+    st.session_state.avg_growth_rate = 0.0
+if 'target_sheet' not in st.session_state:
+    st.session_state.target_sheet = pd.DataFrame()
+if 'calc' not in st.session_state:
+    st.session_state.calc = {}
+if 'job' not in st.session_state:
+    st.session_state.job = None
+if 'published' not in st.session_state:
+    st.session_state.published = 0
+if 'delta_validation' not in st.session_state:
+    st.session_state.delta_validation = None
+# Why the appended file last failed to merge, shown until another file is given
+if 'delta_error' not in st.session_state:
+    st.session_state.delta_error = None
+if 'report_export' not in st.session_state:
+    st.session_state.report_export = None
+if 'profiler' not in st.session_state:
+    st.session_state.profiler = None
+if 'sweep_df' not in st.session_state:
+    st.session_state.sweep_df = pd.DataFrame()
+
+DASHBOARD_VIEWS = [
+    "Target Comparison",
+    "Historical Sales",
+    "Holiday Calendar",
+    "Top Month Sales",
+    "Recent Months Performance",
+    "Site Report",
+    "Future Projections"
+]
+
+def parse_values(text):
+    # "5, 10, 15" or ranges "0:20:2" (start:stop:step, stop included)
+    values = []
+    for part in text.split(","):
+        if ":" in part:
+            start, stop, step = (float(x) for x in part.split(":"))
+            if step <= 0:
+                raise ValueError("step must be positive")
+            values.extend(np.arange(start, stop + step/2, step).round(6))
+        elif part.strip():
+            values.append(float(part))
+    if not values:
+        raise ValueError("no values given")
+    return values
+
+def format_bytes(n):
+    return f"{n / 2**20:.1f} MB" if n >= 2**20 else f"{n / 2**10:.0f} KB"
+
+def chart_options(n_sites, max_series, large_view, top_n, key):
+    # Keyword options for a per-site chart: none for small selections,
+    # otherwise the aggregated view (with a page picker for small multiples)
+    if n_sites <= max_series:
+        return {}
+    page = 0
+    if large_view == "Small Multiples":
+        pages = charts.page_count(n_sites)
+        page = st.number_input(f"Page (of {pages})", 1, pages, 1, key=f"{key}_page") - 1
+    return {"view": large_view, "top_n": top_n, "page": page}
+
+def show_table(df, max_rows, formatter=None):
+    # Static tables for short lists, a scrolling grid past max_rows
+    styled = df.style.format(formatter) if formatter else df
+    if len(df) <= max_rows:
+        st.table(styled)
+    else:
+        st.dataframe(styled, use_container_width=True)
+
+def show_validation(report, label, key):
+    # Rows an upload quarantined: counts per reason and the rows themselves
+    if report is None or not report.quarantined:
+        return
+    st.warning(f"{report.quarantined:,} of {report.rows:,} rows in the {label} failed validation "
+               "and were not loaded.")
+    with st.expander(f"Quarantined rows ({label})"):
+        st.table(report.summary())
+        table = report.table()
+        if report.quarantined > len(table):
+            st.caption(f"Showing the first {len(table):,} quarantined rows.")
+        st.dataframe(table, hide_index=True, use_container_width=True)
+        st.download_button("Download Quarantined Rows (CSV)", table.to_csv(index=False),
+                           file_name=f"quarantined_rows_{key}.csv", mime="text/csv", key=f"{key}_quarantine")
+
+def show_missing_sites(missing):
+    # One warning however many sites lack data; the sites are listed below it
+    if len(missing) == 1:
+        st.warning(f"Insufficient data for {missing[0]}")
+    elif missing:
+        st.warning(f"Insufficient data for {len(missing):,} sites.")
+        with st.expander("Sites with insufficient data"):
+            st.dataframe(pd.DataFrame({"Site": missing}), hide_index=True, use_container_width=True)
+
+def build_report_exports(summary, month, year, base_years):
+    # All site reports as one ZIP plus the columnar summary they were built from
+    archive = BytesIO()
+    write_report_zip(archive, summary, month, year, base_years)
+    exports = {"zip": archive.getvalue(), "csv": summary.to_csv().encode()}
+    try:
+        buffer = BytesIO()
+        summary.to_parquet(buffer)
+        exports["parquet"] = buffer.getvalue()
+    except ImportError:
+        pass
+    return exports
+
+def stage_pending():
+    job = st.session_state.job
+    if job is not None and job.running:
+        st.info("Still calculating, this view appears when its stage finishes.")
+    else:
+        st.info("Not available for this calculation. Press Calculate Targets to run it again.")
+
+def session_profiler():
+    # The session's StageProfiler while Diagnostics is switched on. The
+    # checkboxes are drawn at the end of the run, so their state is read here.
+    profiler = st.session_state.profiler
+    if st.session_state.get("instrument"):
+        if profiler is None:
+            profiler = st.session_state.profiler = StageProfiler()
+        profiler.set_track_memory(st.session_state.get("track_memory", False))
+    elif profiler is not None:
+        profiler.close()
+        profiler = st.session_state.profiler = None
+    return profiler
+
+def show_diagnostics():
+    with st.sidebar.expander("Diagnostics"):
+        st.checkbox("Record Stage Timings", key="instrument",
+                    help="Times and counts each pipeline stage of this session, including background calculations")
+        st.checkbox("Track Peak Memory (slower)", key="track_memory", disabled=not st.session_state.get("instrument"),
+                    help="Peak traced memory per stage; tracing slows every allocation down")
+        profiler = st.session_state.profiler
+        if profiler is None:
+            return
+        stages = profiler.frame()
+        if stages.empty:
+            st.caption("No stages recorded yet.")
+        else:
+            st.dataframe(stages.style.format({
+                "Total (s)": "{:.3f}", "Mean (ms)": "{:.1f}", "Max (ms)": "{:.1f}", "Last (ms)": "{:.1f}",
+                "Peak Memory (MB)": "{:.1f}"
+            }, na_rep="-"), use_container_width=True)
+        caches = cache_stats()
+        st.dataframe(caches.style.format({"hit_rate": "{:.0%}"}), use_container_width=True)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.download_button("JSON", profile_json(profiler, caches), file_name="stage_profile.json",
+                               mime="application/json")
+        with col2:
+            st.download_button("CSV", profile_csv(profiler, caches), file_name="stage_profile.csv",
+                               mime="text/csv")
+        with col3:
+            if st.button("Reset"):
+                profiler.reset()
+                st.rerun()
 
-# Public Holidays Data (2021–2025)
-holidays_sa = {
-    2021: [
-        "Jan 1 (New Year's Day)",
-        "Mar 21 (Human Rights Day)",
-        "Apr 2 (Good Friday)",
-        "Apr 3 (Family Day)",
-        "Apr 27 (Freedom Day)",
-        "May 1 (Workers' Day)",
-        "Jun 16 (Youth Day)",
-        "Aug 9 (National Women's Day)",
-        "Sep 24 (Heritage Day)",
-        "Dec 16 (Day of Reconciliation)",
-        "Dec 25 (Christmas Day)",
-        "Dec 26 (Day of Goodwill)"
-    ],
-    2022: [
-        "Jan 1 (New Year's Day)",
-        "Mar 21 (Human Rights Day)",
-        "Apr 15 (Good Friday)",
-        "Apr 16 (Family Day)",
-        "Apr 27 (Freedom Day)",
-        "May 1 (Workers' Day)",
-        "Jun 16 (Youth Day)",
-        "Aug 9 (National Women's Day)",
-        "Sep 24 (Heritage Day)",
-        "Dec 16 (Day of Reconciliation)",
-        "Dec 25 (Christmas Day)",
-        "Dec 26 (Day of Goodwill)"
-    ],
-    2023: [
-        "Jan 1 (New Year's Day)",
-        "Mar 21 (Human Rights Day)",
-        "Apr 7 (Good Friday)",
-        "Apr 8 (Family Day)",
-        "Apr 27 (Freedom Day)",
-        "May 1 (Workers' Day)",
-        "Jun 16 (Youth Day)",
-        "Aug 9 (National Women's Day)",
-        "Sep 24 (Heritage Day)",
-        "Dec 16 (Day of Reconciliation)",
-        "Dec 25 (Christmas Day)",
-        "Dec 26 (Day of Goodwill)"
-    ],
-    2024: [
-        "Jan 1 (New Year's Day)",
-        "Mar 21 (Human Rights Day)",
-        "Mar 28 (Good Friday)",
-        "Mar 29 (Family Day)",
-        "Apr 27 (Freedom Day)",
-        "May 1 (Workers' Day)",
-        "Jun 16 (Youth Day)",
-        "Aug 9 (National Women's Day)",
-        "Sep 24 (Heritage Day)",
-        "Dec 16 (Day of Reconciliation)",
-        "Dec 25 (Christmas Day)",
-        "Dec 26 (Day of Goodwill)"
-    ],
-    2025: [
-        "Jan 1 (New Year's Day)",
-        "Mar 21 (Human Rights Day)",
-        "Apr 18 (Good Friday)",
-        "Apr 19 (Family Day)",
-        "Apr 27 (Freedom Day)",
-        "May 1 (Workers' Day)",
-        "Jun 16 (Youth Day)",
-        "Aug 9 (National Women's Day)",
-        "Sep 24 (Heritage Day)",
-        "Dec 16 (Day of Reconciliation)",
-        "Dec 25 (Christmas Day)",
-        "Dec 26 (Day of Goodwill)"
-    ]
-}
-
-def round_up_to_thousand(x):
-    return math.ceil(x / 1000) * 1000
-
-def get_last_six_months(selected_month, selected_year):
-    month_order = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", 
-                   "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-    current_month_index = month_order.index(selected_month)
-    months = []
-    for i in range(6):
-        index = (current_month_index - i) % 12
-        month = month_order[index]
-        year = selected_year
-        if index > current_month_index:
-            year -= 1
-        months.append((month, year))
-    return months[::-1]
-
-def get_yoy_growth(site, month, year):
-    current_sales = st.session_state.sales_data[site].get(year, {}).get(month, 0)
-    prev_year_sales = st.session_state.sales_data[site].get(year-1, {}).get(month, 0)
-    return ((current_sales - prev_year_sales)/prev_year_sales)*100 if prev_year_sales !=0 else 0
-
-def get_mom_growth(site, month, year):
-    month_order = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-    current_index = month_order.index(month)
-    prev_month = month_order[(current_index -1)%12]
-    prev_year = year -1 if current_index ==0 else year
-    current_sales = st.session_state.sales_data[site].get(year, {}).get(month, 0)
-    prev_sales = st.session_state.sales_data[site].get(prev_year, {}).get(prev_month, 0)
-    return ((current_sales - prev_sales)/prev_sales)*100 if prev_sales !=0 else 0
-
-def get_future_months(selected_month, selected_year, months_ahead=6):
-    month_order = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", 
-                   "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-    current_month_index = month_order.index(selected_month)
-    future_months = []
-    for i in range(1, months_ahead+1):
-        index = (current_month_index + i) % 12
-        month = month_order[index]
-        year = selected_year + (current_month_index + i) // 12
-        future_months.append((month, year))
-    return future_months
+def poll_background_work():
+    # Poll the background calculation and report export until they finish
+    job = st.session_state.job
+    export = st.session_state.report_export
+    if (job is not None and job.running) or (export is not None and not export[1].done()):
+        time.sleep(0.25)
+        st.rerun()
 
 def main():
     st.set_page_config(layout="wide", page_title="Fuel Sales Dashboard")
+    set_profiler(session_profiler())
     st.title("South Africa Fuel Sales Analysis Dashboard")
 
     # SIDEBAR SETUP
     with st.sidebar:
-        uploaded_file = st.file_uploader("Upload Sales Data (CSV)", type=["csv"])
+        uploaded_file = st.file_uploader("Upload Sales Data (CSV, Parquet or Arrow)", type=UPLOAD_TYPES,
+                                         help="Monthly rows (Year, Month, Sales, Site) or daily rows "
+                                              "(Date, Sales, Site), which are summed to months")
+        delta_file = st.file_uploader("Append New Months (merged into the loaded data)", type=UPLOAD_TYPES,
+                                      key="delta_upload")
         st.sidebar.subheader("Parameters")
         base_years_input = st.text_input("Base Years (comma-separated)", "2021,2022,2024")
         optimistic_percent = st.number_input("Optimistic % Boost", 0.0, 100.0, 5.0)
         conservative_percent = st.number_input("Conservative % Buffer", 0.0, 100.0, 10.0)
-        selected_month = st.selectbox("Select Month", ["Jan", "Feb", "Mar", "Apr", "May", "Jun", 
-                                                      "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])
+        selected_month = st.selectbox("Select Month", MONTHS)
         selected_year = st.number_input("Select Year", 2021, 2025, 2025)
+        trend_window = st.number_input("Trend Window (months)", 2, 24, 6)
         calculation_mode = st.radio("Calculation Mode", ("Per Site", "Combined"), index=0)
+        adjust_working_days = st.checkbox(
+            "Adjust for Working Days",
+            help="Scale each base year's sales to the selected year's working days "
+                 "(weekdays less South African public holidays) before averaging")
+
+        with st.expander("Chart Options"):
+            max_series = st.number_input("Sites per Chart Before Aggregating", 2, 200, charts.MAX_SERIES)
+            large_view = st.selectbox("Large Selection View", charts.LARGE_VIEWS)
+            top_n = st.number_input("Top/Bottom N", 1, 25, 5)
+
+        with st.expander("Scenario Sweep"):
+            sweep_base_input = st.text_input("Base Year Sets (separated by ;)",
+                                             "2021,2022,2024; 2022,2024; 2024")
+            sweep_optimistic_input = st.text_input("Optimistic % Values", "0:20:2.5")
+            sweep_conservative_input = st.text_input("Conservative % Values", "0:20:2.5")
         
         data_load_state = st.text('Loading data...')
         if "available_sites" in st.session_state:
@@ -166,48 +250,97 @@ def main():
     # DATA LOADING
     if uploaded_file is not None:
         try:
-            df = pd.read_csv(uploaded_file)
-            required_columns = {"Year", "Month", "Sales", "Site"}
-            
-            if not required_columns.issubset(df.columns):
-                st.error(f"Missing required columns: {required_columns - set(df.columns)}")
-                return
-            
-            if not pd.api.types.is_integer_dtype(df['Year']):
-                st.error("Year column must contain integer values")
-                return
-            if not pd.api.types.is_string_dtype(df['Month']):
-                st.error("Month column must contain string values (e.g., 'Jan', 'Feb')")
-                return
-            if not (pd.api.types.is_integer_dtype(df['Sales']) or 
-                    pd.api.types.is_float_dtype(df['Sales'])):
-                st.error("Sales column must contain numeric values")
-                return
-
-            sales_data = {}
-            for _, row in df.iterrows():
-                site = str(row["Site"])
-                year = int(row["Year"])
-                month = row["Month"]
-                sales = float(row["Sales"])
-                
-                if site not in sales_data:
-                    sales_data[site] = {}
-                if year not in sales_data[site]:
-                    sales_data[site][year] = {}
-                sales_data[site][year][month] = sales
-
-            st.session_state.sales_data = sales_data
-            st.session_state.available_sites = list(sales_data.keys())
-            st.success(f"Loaded data for {len(sales_data)} sites successfully!")
-            
+            if uploaded_file.file_id != st.session_state.upload_file_id:
+                upload_bytes = uploaded_file.getvalue()
+                upload_key = content_hash(upload_bytes)
+                if upload_key != st.session_state.upload_key:
+                    with stage("Load upload", len(upload_bytes)):
+                        handle = load_dataset(upload_bytes, uploaded_file.name)
+                    if st.session_state.dataset is not None:
+                        st.session_state.dataset.release()
+                    st.session_state.dataset = handle
+                    st.session_state.upload_key = upload_key
+                    st.session_state.available_sites = handle.store.sites
+                    st.session_state.applied_deltas = set()
+                    st.session_state.delta_file_id = None
+                    st.session_state.delta_validation = None
+                    st.session_state.delta_error = None
+                st.session_state.upload_file_id = uploaded_file.file_id
+            st.success(f"Loaded data for {len(st.session_state.dataset.store)} sites successfully!")
+            show_validation(st.session_state.dataset.store.validation, "upload", "upload")
+
+        except UploadError as e:
+            st.error(str(e))
+            return
         except Exception as e:
             st.error(f"Error loading data: {str(e)}")
             st.stop()
 
+    # DELTA MERGE
+    if (delta_file is not None and st.session_state.dataset is not None
+            and delta_file.file_id != st.session_state.delta_file_id):
+        # Each file is merged (or fails to) once, not again on every rerun
+        st.session_state.delta_file_id = delta_file.file_id
+        st.session_state.delta_error = None
+        delta_bytes = delta_file.getvalue()
+        delta_key = content_hash(delta_bytes)
+        if delta_key not in st.session_state.applied_deltas:
+            # The registered store may be shared with other sessions, so the
+            # merge runs on a private store (copied only when it is shared)
+            # that is then registered under the merged key
+            dataset_key = st.session_state.dataset.key
+            store = st.session_state.dataset.detach()
+            new_key = dataset_key
+            refreshed = None
+            st.session_state.delta_validation = None
+            try:
+                with stage("Merge delta", len(delta_bytes)):
+                    touched, st.session_state.delta_validation = merge_upload(store, delta_bytes, delta_file.name)
+                new_key = merged_key(dataset_key, delta_key)
+                st.session_state.applied_deltas.add(delta_key)
+                st.session_state.available_sites = store.sites
+
+                calc = st.session_state.calc
+                if calc and not st.session_state.target_sheet.empty:
+                    refreshed = {"target_sheet": refresh_target_sheet(
+                        st.session_state.target_sheet, store, touched, calc["base_years"],
+                        calc["optimistic"], calc["conservative"], list(calc["sites"]), calc["mode"],
+                        target_year(calc))}
+                st.success(f"Merged {len(touched)} month(s) of new data into the loaded dataset.")
+            except UploadError as e:
+                st.session_state.delta_error = str(e)
+            except Exception as e:
+                st.session_state.delta_error = f"Error merging data: {str(e)}"
+            finally:
+                st.session_state.dataset = registry.publish(new_key, store)
+            calc = st.session_state.calc
+            if new_key != dataset_key and calc:
+                # The dashboard was calculated from the data before the merge;
+                # recalculate it from the merged data, keeping the target
+                # sheet refreshed above
+                if st.session_state.job is not None:
+                    st.session_state.job.cancel()
+                st.session_state.job = CalculationJob(st.session_state.dataset,
+                                                      {**calc, "dataset_key": new_key}, refreshed)
+                st.session_state.published = 0
+                st.session_state.calc = {}
+                st.session_state.results_df = pd.DataFrame()
+
+    if delta_file is not None:
+        if st.session_state.delta_error:
+            st.error(st.session_state.delta_error)
+        show_validation(st.session_state.delta_validation, "appended file", "delta")
+
+    if st.session_state.dataset is not None:
+        usage = st.session_state.dataset.store.memory_usage()
+        st.sidebar.caption(
+            f"Dataset in memory: {format_bytes(usage['total'])} (sales {format_bytes(usage['sales'] + usage['mask'])}, "
+            f"growth index {format_bytes(usage['stats'])}, site names {format_bytes(usage['sites'])})"
+        )
+
     # CALCULATION LOGIC
     if st.button("Calculate Targets"):
-        if not st.session_state.sales_data:
+        if st.session_state.dataset is None:
             st.error("No sales data loaded. Please upload valid data first.")
             return
         if not selected_sites:
@@ -220,115 +353,103 @@ def main():
             st.error("Invalid base years format. Please use comma-separated integers.")
             return
 
-        if calculation_mode == "Per Site":
-            results = {}
-            for site in selected_sites:
-                historical_sales = []
-                for year in base_years:
-                    if (year in st.session_state.sales_data.get(site, {}) and 
-                        selected_month in st.session_state.sales_data[site].get(year, {})):
-                        historical_sales.append(st.session_state.sales_data[site][year][selected_month])
-                if historical_sales:
-                    base = sum(historical_sales) / len(historical_sales)
-                    optimistic = base * (1 + optimistic_percent/100)
-                    conservative = base * (1 - conservative_percent/100)
-                    results[site] = {
-                        "Base Target": round_up_to_thousand(base),
-                        "Optimistic": round_up_to_thousand(optimistic),
-                        "Conservative": round_up_to_thousand(conservative)
-                    }
-                else:
-                    st.warning(f"Insufficient data for {site}")
-            st.session_state.results_df = pd.DataFrame(results).T
-        else:
-            combined_historical_sales = []
-            for year in base_years:
-                total_sales = 0
-                valid = True
-                for site in selected_sites:
-                    if (year in st.session_state.sales_data.get(site, {}) and 
-                        selected_month in st.session_state.sales_data[site].get(year, {})):
-                        total_sales += st.session_state.sales_data[site][year][selected_month]
-                    else:
-                        valid = False
-                        break
-                if valid:
-                    combined_historical_sales.append(total_sales)
-            if combined_historical_sales:
-                base = sum(combined_historical_sales) / len(combined_historical_sales)
-                optimistic = base * (1 + optimistic_percent/100)
-                conservative = base * (1 - conservative_percent/100)
-                results = {
-                    "Base Target": round_up_to_thousand(base),
-                    "Optimistic": round_up_to_thousand(optimistic),
-                    "Conservative": round_up_to_thousand(conservative)
-                }
-                st.session_state.results_df = pd.DataFrame([results], index=["Combined"])
-            else:
+        # Parameters the dashboard below is calculated with; they also key
+        # the result and chart caches
+        calc = calc_params(st.session_state.dataset.key, selected_sites, selected_month, selected_year,
+                           base_years, optimistic_percent, conservative_percent, calculation_mode,
+                           trend_window, adjust_working_days)
+        # Stages run in the background; earlier ones are shown as they finish
+        if st.session_state.job is not None:
+            st.session_state.job.cancel()
+        st.session_state.job = CalculationJob(st.session_state.dataset, calc)
+        st.session_state.published = 0
+
+    job = st.session_state.job
+    if job is not None:
+        results_df = job.result.get("results_df")
+        if results_df is not None:
+            if job.calc["mode"] == "Per Site":
+                show_missing_sites(job.result["missing_sites"])
+            elif results_df.empty:
+                # Keep the previous dashboard
                 st.error("Insufficient data for combined calculation")
+                results_df = None
 
-        # Generate analysis components
-        if not st.session_state.results_df.empty:
-            # Top Month Analysis
-            top_month_data = {}
-            for site in selected_sites:
-                max_sales = 0
-                best_month = ""
-                best_year = 0
-                for year in st.session_state.sales_data.get(site, {}):
-                    for month in st.session_state.sales_data[site][year]:
-                        sales = st.session_state.sales_data[site][year][month]
-                        if sales > max_sales:
-                            max_sales = sales
-                            best_month = month
-                            best_year = year
-                top_month_data[site] = {
-                    "Month": f"{best_month} {best_year}",
-                    "Sales": max_sales
-                }
-            st.session_state.top_month_df = pd.DataFrame(top_month_data).T
-
-            # Last 6 Months Analysis
-            last_six_months = get_last_six_months(selected_month, selected_year)
-            last_six_sales = {}
-            for site in selected_sites:
-                site_sales = []
-                for month, year in last_six_months:
-                    if (year in st.session_state.sales_data.get(site, {}) and 
-                        month in st.session_state.sales_data[site].get(year, {})):
-                        site_sales.append(st.session_state.sales_data[site][year][month])
-                    else:
-                        site_sales.append(0)
-                last_six_sales[site] = site_sales
-            st.session_state.last_six_df = pd.DataFrame(last_six_sales, index=[m[0] for m in last_six_months])
-
-            # Future Projections
-            if "results_df" in st.session_state:
-                months_ahead = 6
-                future_months = get_future_months(selected_month, selected_year, months_ahead)
-                sites = selected_sites if calculation_mode == "Per Site" else ["Combined"]
-                avg_growth = []
-                for site in sites:
-                    sales = st.session_state.last_six_df[site]
-                    growth = (sales.pct_change() * 100).mean()
-                    avg_growth.append(growth)
-                avg_growth_rate = np.mean(avg_growth) / 100 if avg_growth else 0
-                base_target = st.session_state.results_df["Base Target"].mean()
-                projection_data = []
-                for i, (month, year) in enumerate(future_months):
-                    projected = base_target * (1 + avg_growth_rate) ** (i+1)
-                    projection_data.append({
-                        "Month": f"{month} {year}",
-                        "Projected": round(projected),
-                        "Optimistic": round(projected * (1 + optimistic_percent/100)),
-                        "Conservative": round(projected * (1 - conservative_percent/100))
-                    })
-                st.session_state.future_proj = pd.DataFrame(projection_data)
+        # Publish the stages finished since the last run
+        if results_df is not None:
+            if st.session_state.published == 0:
+                st.session_state.calc = job.calc
+                for name in ("target_sheet", "top_month_df", "trend_df", "future_proj"):
+                    st.session_state[name] = pd.DataFrame()
+            outputs = list(job.outputs)
+            for _, frames in outputs[st.session_state.published:]:
+                for name, value in frames.items():
+                    if name != "missing_sites":
+                        st.session_state[name] = value
+            st.session_state.published = len(outputs)
+
+        if job.running:
+            st.progress(job.progress, text=f"Calculating {job.next_stage}...")
+            if st.button("Cancel Calculation"):
+                job.cancel()
+        elif job.cancelled:
+            st.warning("Calculation cancelled. Views of the unfinished stages are not available.")
+        elif job.error is not None:
+            st.error(f"Error calculating targets: {str(job.error)}")
+
+    # SCENARIO SWEEP
+    if st.button("Run Scenario Sweep"):
+        if st.session_state.dataset is None:
+            st.error("No sales data loaded. Please upload valid data first.")
+            return
+        if not selected_sites:
+            st.error("Please select at least one site to analyze.")
+            return
+        try:
+            base_year_sets = [[int(y) for y in part.split(",")] for part in sweep_base_input.split(";")
+                              if part.strip()]
+            if not base_year_sets:
+                raise ValueError("no base year sets given")
+            optimistic_values = parse_values(sweep_optimistic_input)
+            conservative_values = parse_values(sweep_conservative_input)
+        except ValueError:
+            st.error("Invalid sweep values. Use lists like 2021,2022; 2024 for base years and "
+                     "5,10 or 0:20:2.5 for percentages.")
+            return
+        sweep_year = int(selected_year) if adjust_working_days else None
+        with stage("Scenario sweep", len(selected_sites)):
+            st.session_state.sweep_df = scenario_sweep(st.session_state.dataset.store, selected_sites,
+                                                       selected_month, base_year_sets, optimistic_values,
+                                                       conservative_values, calculation_mode, sweep_year)
+        st.session_state.sweep_label = f"{selected_month} {calculation_mode}" + \
+            (f", {sweep_year} working days" if sweep_year else "")
+        st.session_state.sweep_key = ("sweep", st.session_state.dataset.key, tuple(selected_sites),
+                                      selected_month, calculation_mode, str(base_year_sets),
+                                      tuple(optimistic_values), tuple(conservative_values), sweep_year)
+
+    if not st.session_state.sweep_df.empty:
+        st.subheader(f"Scenario Sweep ({st.session_state.sweep_label})")
+        st.image(charts.cached_png(
+            st.session_state.sweep_key,
+            lambda: charts.sweep_heatmap(st.session_state.sweep_df)
+        ), use_column_width=True)
+        st.dataframe(st.session_state.sweep_df.style.format("{:,}"))
+        st.download_button(
+            label="Download Scenario Sweep (CSV)",
+            data=st.session_state.sweep_df.to_csv(),
+            file_name="scenario_sweep.csv",
+            mime="text/csv"
+        )
 
     # DASHBOARD LAYOUT
     if "results_df" in st.session_state and not st.session_state.results_df.empty:
         st.subheader("Dashboard Results")
-        
+        store = st.session_state.dataset.store
+        calc = st.session_state.calc
+        sites = list(calc["sites"])
+        # Charts draw the session's current store as well as the results of calc
+        chart_key = (st.session_state.dataset.key,) + tuple(calc.values())
+
         # Key Metrics
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -337,183 +458,150 @@ def main():
             st.metric("Optimistic Target", f"{st.session_state.results_df['Optimistic'].values[0]:,}")
         with col3:
             st.metric("Conservative Target", f"{st.session_state.results_df['Conservative'].values[0]:,}")
+        if calc["working_days"]:
+            st.caption(f"Targets are adjusted to the working days of {calc['month']} {calc['year']}.")
+        if not st.session_state.target_sheet.empty:
+            st.download_button(
+                label="Download Full-Year Target Sheet (CSV)",
+                data=st.session_state.target_sheet.to_csv(),
+                file_name="target_sheet.csv",
+                mime="text/csv"
+            )
 
-        tabs = st.tabs([
-            "Target Comparison", 
-            "Historical Sales", 
-            "Holiday Calendar", 
-            "Top Month Sales", 
-            "Last 6 Months Performance",
-            "Site Report",
-            "Future Projections"
-        ])
-
-        # Tab 1: Target Comparison
-        with tabs[0]:
-            fig, ax = plt.subplots(figsize=(10, 6))
-            if calculation_mode == "Per Site":
-                st.session_state.results_df.plot(kind='bar', ax=ax)
-                plt.title("Target Comparison by Site")
-            else:
-                st.session_state.results_df.T.plot(kind='bar', ax=ax)
-                plt.title("Combined Target Comparison")
-            plt.ylabel("Sales (R)")
-            st.pyplot(fig)
-
-        # Tab 2: Historical Sales
-        with tabs[1]:
-            if calculation_mode == "Per Site":
-                df_sales = pd.DataFrame()
-                for site in selected_sites:
-                    years = []
-                    sales = []
-                    for year in base_years:
-                        if (year in st.session_state.sales_data.get(site, {}) and 
-                            selected_month in st.session_state.sales_data[site].get(year, {})):
-                            years.append(year)
-                            sales.append(st.session_state.sales_data[site][year][selected_month])
-                    df_sales = pd.concat([df_sales, pd.DataFrame({"Year": years, "Sales": sales, "Site": site})])
-                fig, ax = plt.subplots(figsize=(10, 6))
-                for site in selected_sites:
-                    subset = df_sales[df_sales['Site'] == site]
-                    ax.plot(subset['Year'], subset['Sales'], marker='o', label=site)
-                plt.title(f"Historical Sales for {selected_month}")
-                plt.xlabel("Year")
-                plt.ylabel("Sales (R)")
-                plt.legend()
-                st.pyplot(fig)
-            else:
-                combined_sales = []
-                for year in base_years:
-                    total = 0
-                    valid = True
-                    for site in selected_sites:
-                        if (year in st.session_state.sales_data.get(site, {}) and 
-                            selected_month in st.session_state.sales_data[site].get(year, {})):
-                            total += st.session_state.sales_data[site][year][selected_month]
-                        else:
-                            valid = False
-                            break
-                    combined_sales.append(total if valid else np.nan)
-                fig, ax = plt.subplots(figsize=(8, 4))
-                ax.plot(base_years, combined_sales, marker='o')
-                plt.title(f"Combined Historical Sales for {selected_month}")
-                plt.xlabel("Year")
-                plt.ylabel("Sales (R)")
-                st.pyplot(fig)
-
-        # Tab 3: Holiday Calendar
-        with tabs[2]:
-            if selected_year in holidays_sa:
-                holidays = [h for h in holidays_sa[selected_year] if h.startswith(selected_month)]
-                st.table(pd.DataFrame(holidays, columns=["Holiday"]))
-            else:
-                st.write("No holidays data available for selected year")
-
-        # Tab 4: Top Month Sales
-        with tabs[3]:
-            st.table(st.session_state.top_month_df.style.format({"Sales": "{:,}"}))
-
-        # Tab 5: Last 6 Months Performance
-        with tabs[4]:
-            fig, ax = plt.subplots(figsize=(12, 6))
-            for site in selected_sites:
-                ax.plot(st.session_state.last_six_df.index, st.session_state.last_six_df[site], 
-                        marker='o', label=site)
-            plt.title("Last 6 Months Sales Trend")
-            plt.xlabel("Month")
-            plt.ylabel("Sales (R)")
-            plt.legend()
-            st.pyplot(fig)
-            
-            growth_rates = {}
-            for site in selected_sites:
-                current = st.session_state.last_six_df[site].iloc[-1]
-                previous = st.session_state.last_six_df[site].iloc[-2]
-                growth = ((current - previous)/previous)*100 if previous !=0 else 0
-                growth_rates[site] = f"{growth:.1f}%"
-            st.table(pd.DataFrame(growth_rates, index=["Growth"]).T)
-
-        # Tab 6: Site Report
-        with tabs[5]:
-            selected_report_site = st.selectbox("Select Site for Report", selected_sites)
-            if selected_report_site not in st.session_state.sales_data:
-                st.error(f"No data available for {selected_report_site}")
-            else:
-                current_sales = st.session_state.sales_data[selected_report_site].get(selected_year, {}).get(selected_month, 0)
-                target = st.session_state.results_df.loc[selected_report_site]["Base Target"]
-                variance = (current_sales - target)/target * 100 if target !=0 else 0
-                
-                # KPIs
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Current Month Sales", value=f"{current_sales:,}")
-                with col2:
-                    st.metric("YoY Growth", value=f"{get_yoy_growth(selected_report_site, selected_month, selected_year):.1f}%")
-                with col3:
-                    st.metric("MoM Growth", value=f"{get_mom_growth(selected_report_site, selected_month, selected_year):.1f}%")
-                
-                # Historical Sales
-                hist_sales = []
-                for year in base_years:
-                    if (year in st.session_state.sales_data[selected_report_site] and 
-                        selected_month in st.session_state.sales_data[selected_report_site].get(year, {})):
-                        hist_sales.append({
-                            "Year": year,
-                            "Sales": st.session_state.sales_data[selected_report_site][year][selected_month]
-                        })
-                df_hist = pd.DataFrame(hist_sales)
-                st.table(df_hist.style.format({"Sales": "{:,}"}))
-                
-                # Download Report
-                def convert_types(obj):
-                    if isinstance(obj, (np.integer, np.floating)):
-                        return int(obj) if isinstance(obj, np.integer) else float(obj)
-                    return obj
-                
-                report_data = {
-                    "KPIs": {
-                        "Current Month Sales": current_sales,
-                        "YoY Growth": f"{get_yoy_growth(selected_report_site, selected_month, selected_year):.1f}%",
-                        "MoM Growth": f"{get_mom_growth(selected_report_site, selected_month, selected_year):.1f}%",
-                        "Variance from Target": f"{variance:.1f}%"
-                    },
-                    "Historical Sales": df_hist.to_dict('records'),
-                    "Target Details": st.session_state.results_df.loc[selected_report_site].to_dict()
-                }
-                st.download_button(
-                    label="Download Site Report (JSON)",
-                    data=json.dumps(report_data, default=convert_types, indent=4),
-                    file_name=f"{selected_report_site}_report_{selected_month}_{selected_year}.json",
-                    mime="application/json"
-                )
-
-        # Tab 7: Future Projections
-        with tabs[6]:
-            if "future_proj" in st.session_state and not st.session_state.future_proj.empty:
-                st.table(st.session_state.future_proj.style.format({
-                    "Projected": "{:,}",
-                    "Optimistic": "{:,}",
-                    "Conservative": "{:,}"
-                }))
-                
-                fig, ax = plt.subplots(figsize=(12, 6))
-                ax.plot(st.session_state.future_proj["Month"], 
-                        st.session_state.future_proj["Projected"], 
-                        marker='o', label="Projected Target")
-                ax.plot(st.session_state.future_proj["Month"], 
-                        st.session_state.future_proj["Optimistic"], 
-                        linestyle="--", label="Optimistic")
-                ax.plot(st.session_state.future_proj["Month"], 
-                        st.session_state.future_proj["Conservative"], 
-                        linestyle=":", label="Conservative")
-                plt.title("Sales Projections")
-                plt.xlabel("Month")
-                plt.ylabel("Sales (R)")
-                plt.xticks(rotation=45)
-                plt.legend()
-                st.pyplot(fig)
-                st.write(f"Average MoM Growth Rate: {avg_growth_rate * 100:.1f}%")
+        # Only the selected view is rendered; charts come from the render cache
+        view = st.radio("View", DASHBOARD_VIEWS, horizontal=True, key="dashboard_view",
+                        label_visibility="collapsed")
+
+        # Rendering time of the selected view, charts included
+        with stage(f"View: {view}"):
+            if view == "Target Comparison":
+                opts = chart_options(len(st.session_state.results_df), max_series, large_view, top_n, "targets")
+                st.image(charts.cached_png(
+                    ("targets",) + chart_key + tuple(opts.values()),
+                    lambda: charts.target_comparison(st.session_state.results_df, calc["mode"], **opts)
+                ), use_column_width=True)
+
+            elif view == "Historical Sales":
+                opts = chart_options(len(sites), max_series, large_view, top_n, "historical")
+                st.image(charts.cached_png(
+                    ("historical",) + chart_key + tuple(opts.values()),
+                    lambda: charts.historical_sales(store, sites, calc["month"], list(calc["base_years"]),
+                                                    calc["mode"], **opts)
+                ), use_column_width=True)
+
+            elif view == "Holiday Calendar":
+                holidays = month_holidays(calc["year"], calc["month"])
+                if holidays.empty:
+                    st.write("No public holidays in the selected month")
+                else:
+                    st.table(pd.DataFrame([f"{date:%b} {date.day} ({name})" for date, name in holidays.items()],
+                                          columns=["Holiday"]))
+                # The figures behind the working-day adjustment
+                st.markdown(f"**Working days in {calc['month']}**")
+                years = sorted(set(calc["base_years"]) | {calc["year"]})
+                figures = working_day_sales(store, sites, calc["month"], years, calc["year"])
+                st.table(figures.style.format("{:,.0f}", na_rep="-"))
+
+            elif view == "Top Month Sales":
+                if st.session_state.top_month_df.empty:
+                    stage_pending()
+                else:
+                    show_table(st.session_state.top_month_df, max_series, {"Sales": "{:,}"})
+
+            elif view == "Recent Months Performance" and st.session_state.trend_df.empty:
+                stage_pending()
+
+            elif view == "Recent Months Performance":
+                opts = chart_options(len(sites), max_series, large_view, top_n, "trend")
+                st.image(charts.cached_png(
+                    ("trend",) + chart_key + tuple(opts.values()),
+                    lambda: charts.sales_trend(st.session_state.trend_df, **opts)
+                ), use_column_width=True)
+
+                trend = st.session_state.trend_df.to_numpy(dtype=np.float64)
+                current, previous = trend[-1], trend[-2]
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    growth = np.where(previous != 0, (current - previous)/previous*100, 0.0)
+                show_table(pd.DataFrame({"Growth": [f"{g:.1f}%" for g in growth]},
+                                        index=st.session_state.trend_df.columns), max_series)
+
+            elif view == "Site Report":
+                # Network-wide export, built in the background from one vectorised summary
+                if st.button("Prepare All Site Reports"):
+                    summary = report_summary(store, st.session_state.results_df, sites, calc["month"],
+                                             calc["year"], list(calc["base_years"]))
+                    st.session_state.report_export = (chart_key, jobs.executor.submit(
+                        contextvars.copy_context().run, build_report_exports, summary, calc["month"],
+                        calc["year"], list(calc["base_years"])))
+                export = st.session_state.report_export
+                if export is not None and export[0] == chart_key:
+                    if not export[1].done():
+                        st.info(f"Preparing reports for {len(sites)} sites...")
+                    elif export[1].exception() is not None:
+                        st.error(f"Error preparing site reports: {str(export[1].exception())}")
+                    else:
+                        exports = export[1].result()
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.download_button("Download All Site Reports (ZIP)", exports["zip"],
+                                               file_name=f"site_reports_{calc['month']}_{calc['year']}.zip",
+                                               mime="application/zip")
+                        with col2:
+                            st.download_button("Download Report Summary (CSV)", exports["csv"],
+                                               file_name=f"site_report_summary_{calc['month']}_{calc['year']}.csv",
+                                               mime="text/csv")
+                        if "parquet" in exports:
+                            with col3:
+                                st.download_button("Download Report Summary (Parquet)", exports["parquet"],
+                                                   file_name=f"site_report_summary_{calc['month']}_{calc['year']}.parquet",
+                                                   mime="application/octet-stream")
+
+                selected_report_site = st.selectbox("Select Site for Report", sites)
+                if selected_report_site not in store.site_index:
+                    st.error(f"No data available for {selected_report_site}")
+                else:
+                    report_data = site_report(store, st.session_state.results_df, selected_report_site,
+                                              calc["month"], calc["year"], list(calc["base_years"]))
+                    kpis = report_data["KPIs"]
+
+                    # KPIs
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Current Month Sales", value=f"{kpis['Current Month Sales']:,}")
+                    with col2:
+                        st.metric("YoY Growth", value=kpis["YoY Growth"])
+                    with col3:
+                        st.metric("MoM Growth", value=kpis["MoM Growth"])
+
+                    # Historical Sales
+                    df_hist = pd.DataFrame(report_data["Historical Sales"], columns=["Year", "Sales"])
+                    st.table(df_hist.style.format({"Sales": "{:,}"}))
+
+                    # Download Report
+                    st.download_button(
+                        label="Download Site Report (JSON)",
+                        data=report_json(report_data),
+                        file_name=f"{selected_report_site}_report_{calc['month']}_{calc['year']}.json",
+                        mime="application/json"
+                    )
+
+            elif view == "Future Projections":
+                if "future_proj" in st.session_state and not st.session_state.future_proj.empty:
+                    st.table(st.session_state.future_proj.style.format({
+                        "Projected": "{:,}",
+                        "Optimistic": "{:,}",
+                        "Conservative": "{:,}"
+                    }))
+
+                    st.image(charts.cached_png(
+                        ("projections",) + chart_key,
+                        lambda: charts.projections(st.session_state.future_proj)
+                    ), use_column_width=True)
+                    st.write(f"Average MoM Growth Rate: {st.session_state.avg_growth_rate * 100:.1f}%")
+                else:
+                    stage_pending()
 
 if __name__ == "__main__":
     main()
+    show_diagnostics()
+    poll_background_work()